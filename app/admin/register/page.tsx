@@ -29,6 +29,7 @@ export default function AdminRegister() {
     const [success, setSuccess] = useState<string | null>(null);
     const [error, setError] = useState<string | null>(null);
     const [allUsers, setAllUsers] = useState<User[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
     const [deletingEmail, setDeletingEmail] = useState<string | null>(null);
 
     useEffect(() => {
@@ -39,15 +40,17 @@ export default function AdminRegister() {
         fetchUsers();
     }, [auth, router]);
 
-    const fetchUsers = async () => {
+    const fetchUsers = async (cursor: string | null = null) => {
         setFetchingUsers(true);
         try {
-            const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/auth/users`, {
+            const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+            const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/auth/users${query}`, {
                 headers: { Authorization: `Bearer ${auth.token}` },
             });
             if (!res.ok) throw new Error("Failed to fetch users");
             const data = await res.json();
-            setAllUsers(data);
+            setAllUsers((prev) => (cursor ? [...prev, ...data] : data));
+            setNextCursor(res.headers.get("X-Next-Cursor"));
         } catch (err) {
             console.error("Failed to fetch users:", err);
         } finally {
@@ -249,7 +252,7 @@ export default function AdminRegister() {
                             </h3>
                         </div>
                         <button
-                            onClick={fetchUsers}
+                            onClick={() => fetchUsers()}
                             className="text-slate-400 hover:text-white transition-colors"
                             title="Refresh"
                         >
@@ -257,7 +260,7 @@ export default function AdminRegister() {
                         </button>
                     </div>
 
-                    {fetchingUsers ? (
+                    {fetchingUsers && allUsers.length === 0 ? (
                         <p className="text-sm text-slate-500 text-center py-4">Loading users...</p>
                     ) : allUsers.length === 0 ? (
                         <p className="text-sm text-slate-500 text-center py-4">No users registered yet.</p>
@@ -298,6 +301,15 @@ export default function AdminRegister() {
                                     )}
                                 </div>
                             ))}
+                            {nextCursor && (
+                                <button
+                                    onClick={() => fetchUsers(nextCursor)}
+                                    disabled={fetchingUsers}
+                                    className="w-full text-sm text-slate-400 hover:text-white transition-colors disabled:opacity-40 py-2"
+                                >
+                                    {fetchingUsers ? "Loading..." : "Load more"}
+                                </button>
+                            )}
                         </div>
                     )}
                 </div>
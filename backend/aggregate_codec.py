@@ -0,0 +1,48 @@
+# aggregate_codec.py
+import os
+import struct
+
+import numpy as np
+
+# Storage dtype for new aggregates; existing blobs keep whatever they were written with
+AGGREGATE_DTYPE = np.dtype(os.environ.get("AGGREGATE_DTYPE", "float32"))
+
+MAGIC = b"SVAG"
+FORMAT_VERSION = 1
+# magic, format version, dtype code, pad, dim, count
+_HEADER = struct.Struct("<4sBBxxIQ")
+_DTYPE_CODES = {np.dtype("float32"): 1, np.dtype("float64"): 2}
+_CODE_DTYPES = {code: dtype for dtype, code in _DTYPE_CODES.items()}
+
+
+def encode_aggregate(total: np.ndarray, compensation: np.ndarray, count: int) -> bytes:
+    """
+    Layout: header, then the running sum and its Kahan compensation term,
+    each `dim` little-endian values of the stored dtype.
+    """
+    dtype = total.dtype
+    if dtype not in _DTYPE_CODES:
+        raise ValueError(f"Unsupported aggregate dtype {dtype}")
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, _DTYPE_CODES[dtype], total.shape[0], count)
+    return b"".join((header, total.astype("<" + dtype.str[1:], copy=False).tobytes(),
+                     compensation.astype("<" + dtype.str[1:], copy=False).tobytes()))
+
+
+def decode_aggregate(blob: bytes, dim: int, count: int):
+    """
+    Returns read-only (sum, compensation) views into blob. Legacy blobs (a bare
+    float64 running mean) are read as sum = mean * count using the row's count.
+    """
+    if blob[:4] == MAGIC:
+        magic, version, code, stored_dim, stored_count = _HEADER.unpack_from(blob)
+        if version != FORMAT_VERSION or code not in _CODE_DTYPES:
+            raise ValueError(f"Unknown aggregate format {version}/{code}")
+        if stored_dim != dim:
+            raise ValueError(f"Aggregate has dim {stored_dim}, expected {dim}")
+        dtype = _CODE_DTYPES[code].newbyteorder("<")
+        values = np.frombuffer(blob, dtype=dtype, count=2 * dim, offset=_HEADER.size)
+        return values[:dim], values[dim:]
+    if len(blob) != dim * 8:
+        raise ValueError(f"Aggregate blob of {len(blob)} bytes is neither versioned nor a {dim}-d float64 mean")
+    mean = np.frombuffer(blob, dtype="<f8")
+    return mean * count, np.zeros(dim)
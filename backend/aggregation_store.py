@@ -0,0 +1,271 @@
+# aggregation_store.py
+import os
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from fl_aggregation import (
+    DepartmentFLState,
+    load_department_state,
+    load_department_states,
+    save_department_state,
+    record_new_submissions,
+    DuplicateSubmissionError,
+    StaleStateError,
+    _state_id,
+)
+from metrics import count
+from rollups import apply_rollup_delta
+
+# Submits are acknowledged before they reach the DB. A flush can still drop an
+# acknowledged one: when the user's submission row already exists (another
+# worker got it first), or when other workers filled the round meanwhile
+# (counted as write_behind_dropped). Submission status is read from the DB,
+# so a dropped user shows as not submitted and can submit again.
+WRITE_BEHIND = os.environ.get("AGGREGATION_WRITE_BEHIND", "0") == "1"
+FLUSH_INTERVAL_S = float(os.environ.get("AGGREGATION_FLUSH_INTERVAL_S", "1.0"))
+FLUSH_MAX_PENDING = int(os.environ.get("AGGREGATION_FLUSH_MAX_PENDING", "64"))
+# How long a cached row (count, round_complete, cycle) is trusted before it is
+# re-read, so writes and resets by other workers are noticed
+BASE_TTL_S = float(os.environ.get("AGGREGATION_BASE_TTL_S", str(FLUSH_INTERVAL_S)))
+NUM_SHARDS = 16
+MAX_FLUSH_RETRIES = 5
+
+
+class _Entry:
+    def __init__(self, department: str, form_id: str, base: DepartmentFLState, loaded_at: float):
+        self.department = department
+        self.form_id = form_id
+        self.base = base  # last row seen in the DB, without the embedding
+        self.loaded_at = loaded_at
+        self.pending = {}  # email -> embedding, in arrival order
+        self.inflight = set()  # emails being flushed; they still count until committed
+
+    @property
+    def client_count(self):
+        return self.base.client_count + len(self.pending) + len(self.inflight)
+
+    def has_user(self, email: str) -> bool:
+        return email in self.pending or email in self.inflight
+
+    def can_accept_feedback(self):
+        return not self.base.round_complete and self.client_count < self.base.max_clients
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+
+class AggregationStore:
+    """
+    Write-behind layer for department aggregates.
+
+    Submissions are held in memory per _state_id until flush(). Each state is
+    flushed in its own transaction: the users' submission rows are inserted
+    (skipping any the DB already has), and only the embeddings of newly
+    recorded users, up to max_clients against the freshly read row, are
+    merged into the aggregate. So after a crash the DB never holds a
+    submission without its embedding or vice versa, and one bad entry cannot
+    hold back the others; unflushed users can simply submit again.
+    """
+
+    def __init__(self, session_factory, embedding_dim: int, max_clients: int,
+                 flush_interval: float = FLUSH_INTERVAL_S, max_pending: int = FLUSH_MAX_PENDING,
+                 base_ttl: float = BASE_TTL_S):
+        self.session_factory = session_factory
+        self.embedding_dim = embedding_dim
+        self.max_clients = max_clients
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.base_ttl = base_ttl
+        self._shards = [_Shard() for _ in range(NUM_SHARDS)]
+        self._flush_lock = threading.Lock()
+        self._pending_count = 0
+        self._count_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _shard(self, sid: str) -> _Shard:
+        return self._shards[zlib.crc32(sid.encode("utf-8")) % NUM_SHARDS]
+
+    def _entry(self, shard: _Shard, department: str, form_id: str, db):
+        # Caller holds shard.lock
+        sid = _state_id(department, form_id)
+        entry = shard.entries.get(sid)
+        now = time.monotonic()
+        if entry is None or now - entry.loaded_at > self.base_ttl:
+            base = load_department_states(department, [form_id], self.embedding_dim, self.max_clients, db)[form_id]
+            if entry is None:
+                entry = shard.entries[sid] = _Entry(department, form_id, base, now)
+            else:
+                entry.base = base
+                entry.loaded_at = now
+        return entry
+
+    def is_pending(self, email: str, department: str, form_id: str) -> bool:
+        shard = self._shard(_state_id(department, form_id))
+        with shard.lock:
+            entry = shard.entries.get(_state_id(department, form_id))
+            return entry is not None and entry.has_user(email)
+
+    def current_cycle(self, department: str, form_id: str, db) -> int:
+        shard = self._shard(_state_id(department, form_id))
+        with shard.lock:
+            return self._entry(shard, department, form_id, db).base.cycle
+
+    def can_accept_feedback(self, department: str, form_id: str, db) -> bool:
+        shard = self._shard(_state_id(department, form_id))
+        with shard.lock:
+            return self._entry(shard, department, form_id, db).can_accept_feedback()
+
+    def add(self, email: str, department: str, form_id: str, embedding, db):
+        """
+        Returns the client count including pending submissions, or None if the
+        round is full.
+        """
+        shard = self._shard(_state_id(department, form_id))
+        with shard.lock:
+            entry = self._entry(shard, department, form_id, db)
+            if entry.has_user(email):
+                raise DuplicateSubmissionError(email)
+            if not entry.can_accept_feedback():
+                return None
+            entry.pending[email] = np.array(embedding, dtype=np.float64)
+            client_count = entry.client_count
+        with self._count_lock:
+            self._pending_count += 1
+            if self._pending_count >= self.max_pending:
+                self._wake.set()
+        return client_count
+
+    def flush_and_discard(self, department: str, form_id: str) -> int:
+        """
+        Flushes one state and drops its entry, for a reset. Submissions to
+        the state wait on its shard lock meanwhile, so none can be accepted
+        into an entry that is about to be dropped; later ones start a fresh
+        entry. Returns the number of submissions recorded.
+        """
+        sid = _state_id(department, form_id)
+        shard = self._shard(sid)
+        with self._flush_lock, shard.lock:
+            entry = shard.entries.pop(sid, None)
+            if entry is None or not entry.pending:
+                return 0
+            batch = entry.pending
+            db = self.session_factory()
+            try:
+                _, recorded = self._flush_entry(entry, batch, db)
+            except Exception:
+                db.rollback()
+                shard.entries[sid] = entry
+                raise
+            finally:
+                db.close()
+            for _ in range(len(batch) - len(recorded)):
+                count("write_behind_dropped")
+            with self._count_lock:
+                self._pending_count -= len(batch)
+            return len(recorded)
+
+    def _take_dirty(self):
+        dirty = []
+        for shard in self._shards:
+            with shard.lock:
+                for entry in shard.entries.values():
+                    if not entry.pending:
+                        continue
+                    dirty.append((entry, entry.pending))
+                    entry.inflight = set(entry.pending)
+                    entry.pending = {}
+        return dirty
+
+    def _restore(self, entry: _Entry, batch: dict):
+        # Put the batch back ahead of newer submissions so the next flush retries it
+        with self._shard(_state_id(entry.department, entry.form_id)).lock:
+            batch.update(entry.pending)
+            entry.pending = batch
+            entry.inflight = set()
+
+    def _flush_entry(self, entry: _Entry, batch: dict, db):
+        """One transaction for one state. Returns (saved state, emails recorded)."""
+        for attempt in range(MAX_FLUSH_RETRIES):
+            state = load_department_state(entry.department, entry.form_id, self.embedding_dim, self.max_clients, db)
+            # Other workers may have filled the round since this one accepted these users
+            room = 0 if state.round_complete else max(self.max_clients - state.client_count, 0)
+            emails = list(batch)[:room]
+            recorded = record_new_submissions(emails, entry.department, entry.form_id, state.cycle, db)
+            delta = DepartmentFLState(self.embedding_dim, self.max_clients)
+            for email in emails:
+                if email in recorded:
+                    delta.add_client_embedding(batch[email])
+            try:
+                if delta.client_count:
+                    state.merge(delta)
+                    save_department_state(entry.department, entry.form_id, state, db, commit=False)
+                    apply_rollup_delta(entry.department, entry.form_id, delta, db)
+                db.commit()
+                return state, recorded
+            except StaleStateError:
+                continue
+        raise StaleStateError(_state_id(entry.department, entry.form_id))
+
+    def flush(self) -> int:
+        """Returns the number of submissions recorded. Failed entries are kept for the next flush."""
+        with self._flush_lock:
+            dirty = self._take_dirty()
+            if not dirty:
+                return 0
+            flushed = 0
+            error = None
+            db = self.session_factory()
+            try:
+                for entry, batch in dirty:
+                    try:
+                        state, recorded = self._flush_entry(entry, batch, db)
+                    except Exception as e:
+                        db.rollback()
+                        self._restore(entry, batch)
+                        error = error or e
+                        continue
+                    # Already submitted elsewhere, or the round filled up meanwhile
+                    for _ in range(len(batch) - len(recorded)):
+                        count("write_behind_dropped")
+                    with self._shard(_state_id(entry.department, entry.form_id)).lock:
+                        entry.base = state
+                        entry.loaded_at = time.monotonic()
+                        entry.inflight = set()
+                    with self._count_lock:
+                        self._pending_count -= len(batch)
+                    flushed += len(recorded)
+            finally:
+                db.close()
+            if error is not None:
+                raise error
+            return flushed
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Aggregation flush failed, will retry: {e!r}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="aggregation-flush", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
@@ -1,11 +1,64 @@
 # anchor_embeddings.py
-from sentence_transformers import SentenceTransformer
-from anchors import INSIGHT_ANCHORS
+import hashlib
+import json
+import os
+import tempfile
+
 import numpy as np
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+from anchors import INSIGHT_ANCHORS
+from model_registry import CACHE_DIR, EMBEDDING_BACKEND, MODEL_NAME, get_model
+
+def _cache_key(model_name: str, backend: str, anchors: dict) -> str:
+    payload = json.dumps([model_name, backend, sorted(anchors.items())], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _cache_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"anchors-{key[:16]}.npz")
+
+def _read_cache(path: str, key: str):
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["key"]) != key:
+                return None
+            return list(data["keys"]), np.array(data["embeddings"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _write_cache(path: str, key: str, keys, embeddings: np.ndarray):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".npz")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, key=np.array(key), keys=np.array(keys), embeddings=embeddings)
+        os.replace(tmp_path, path)
+    except OSError:
+        # A read-only deploy still works, it just re-encodes next start
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def load_anchor_embeddings(anchors: dict = INSIGHT_ANCHORS, model_name: str = MODEL_NAME, backend: str = EMBEDDING_BACKEND) -> dict:
+    key = _cache_key(model_name, backend, anchors)
+    path = _cache_path(key)
+    cached = _read_cache(path, key)
+    if cached is not None:
+        keys, embeddings = cached
+    else:
+        keys = list(anchors.keys())
+        embeddings = np.asarray(get_model(model_name, backend).encode([anchors[k] for k in keys]))
+        _write_cache(path, key, keys, embeddings)
+    return {k: embeddings[i].tolist() for i, k in enumerate(keys)}
+
+def normalize_rows(matrix) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.ascontiguousarray(matrix / np.maximum(norms, 1e-12))
+
+def normalized_anchor_matrix(anchor_embeddings: dict) -> np.ndarray:
+    return normalize_rows(list(anchor_embeddings.values()))
+
+ANCHOR_EMBEDDINGS = load_anchor_embeddings()
 
-ANCHOR_EMBEDDINGS = {
-    key: model.encode(text).tolist()
-    for key, text in INSIGHT_ANCHORS.items()
-}
\ No newline at end of file
+# Row i of ANCHOR_MATRIX is the unit-length embedding of ANCHOR_KEYS[i]
+ANCHOR_KEYS = list(ANCHOR_EMBEDDINGS.keys())
+ANCHOR_MATRIX = normalized_anchor_matrix(ANCHOR_EMBEDDINGS)
@@ -1,18 +1,36 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
+from typing import Dict, Optional
 import numpy as np
 import os
 
-from embedding import generate_embedding
-from fl_aggregation import load_department_state, save_department_state, reset_department_state
-from insights import generate_insights
+from embedding import generate_embedding_async, get_batch_stats, start_encoder, shutdown_encoder
+from fl_aggregation import (
+    load_department_state,
+    load_department_states,
+    submit_client_embedding,
+    has_submitted,
+    reset_department_state,
+    DuplicateSubmissionError,
+    StaleStateError,
+)
+from insights import INSIGHT_MAX_TOP_K, INSIGHT_TOP_K, generate_insights
+from aggregation_store import AggregationStore, WRITE_BEHIND
+from insights_cache import InsightsCache
 from auth.auth_routes import router as auth_router
 from auth.dependencies import get_current_user
-from database import init_db, get_db, User
+from dashboard import org_status
+from database import init_db, get_db, get_pool_stats, SessionLocal
+from forms import list_forms, form_exists, create_form
+from history import TREND_DEFAULT_CYCLES, load_trend
+from metrics import METRICS_TOKEN, MetricsMiddleware, count, register_gauge, render as render_metrics, stage
+from rollups import COMPANY, division_scope, ensure_rollups, list_divisions, load_rollup, set_department_division
+from taxonomies import TaxonomyConflictError, list_taxonomies, remove_taxonomy, resolve_taxonomy, save_taxonomy
 
 ALLOWED_ORIGINS = os.environ.get(
     "ALLOWED_ORIGINS",
@@ -21,12 +39,41 @@ ALLOWED_ORIGINS = os.environ.get(
 
 EMBEDDING_DIM = 384
 MAX_EMPLOYEES_PER_DEPT = 20
-VALID_FORM_IDS = {"1", "2", "3"}
+
+# Optional write-behind aggregation (AGGREGATION_WRITE_BEHIND=1)
+aggregation_store = (
+    AggregationStore(SessionLocal, EMBEDDING_DIM, MAX_EMPLOYEES_PER_DEPT)
+    if WRITE_BEHIND else None
+)
+
+insights_cache = InsightsCache()
+
+register_gauge("encoder_queued", "Texts waiting for an encoder batch.", lambda: get_batch_stats()["queued"])
+register_gauge("insights_cache_entries", "Entries in the insights cache.", lambda: insights_cache.stats()["entries"])
+register_gauge("db_pool_checked_out", "Database connections currently checked out.",
+               lambda: get_pool_stats()["checked_out"])
+
+_database_ready = False
+
+def prepare_database():
+    """Migrations and rollup backfill; serve.py runs this once before forking workers."""
+    global _database_ready
+    init_db()
+    with SessionLocal() as db:
+        ensure_rollups(EMBEDDING_DIM, db)
+    _database_ready = True
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    init_db()
+    if not _database_ready:
+        prepare_database()
+    await run_in_threadpool(start_encoder)
+    if aggregation_store is not None:
+        aggregation_store.start()
     yield
+    if aggregation_store is not None:
+        aggregation_store.stop()
+    shutdown_encoder()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -36,7 +83,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(MetricsMiddleware)
 
 @app.options("/{rest_of_path:path}")
 async def preflight_handler(rest_of_path: str, request: Request):
@@ -58,7 +107,7 @@ class FeedbackRequest(BaseModel):
 
 
 @app.post("/feedback/submit")
-def submit_feedback(
+async def submit_feedback(
     payload: FeedbackRequest,
     user=Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -69,47 +118,101 @@ def submit_feedback(
     if payload.department != user["department"]:
         raise HTTPException(status_code=403, detail="Department mismatch")
 
-    if payload.form_id not in VALID_FORM_IDS:
-        raise HTTPException(status_code=400, detail="Invalid form ID")
+    # DB work runs on the threadpool; encoding is awaited from the batch
+    # encoder (and its worker processes, if ENCODER_PROCESSES is set)
+    with stage("submit_check"):
+        dept_state = await run_in_threadpool(_check_can_submit, payload, user, db)
+
+    with stage("encode_wait"):
+        embedding = np.array(await generate_embedding_async(payload.feedback_text))
+    del payload.feedback_text
+
+    with stage("submit_record"):
+        client_count = await run_in_threadpool(_record_submission, payload, user, db, embedding, dept_state)
+    del embedding
+
+    return {
+        "message": "Feedback aggregated successfully",
+        "submitted_count": client_count
+    }
 
-    db_user = db.query(User).filter(User.email == user["email"]).first()
 
-    submitted_field = f"submitted_form_{payload.form_id}"
-    if getattr(db_user, submitted_field):
-        raise HTTPException(status_code=403, detail=f"Already submitted form {payload.form_id}")
+def _check_can_submit(payload: FeedbackRequest, user: dict, db: Session):
+    department = user["department"]
+    form_id = payload.form_id
+
+    if not form_exists(db, form_id):
+        raise HTTPException(status_code=400, detail="Invalid form ID")
+
+    if aggregation_store is not None:
+        cycle = aggregation_store.current_cycle(department, form_id, db)
+        if (
+            aggregation_store.is_pending(user["email"], department, form_id)
+            or has_submitted(user["email"], department, form_id, cycle, db)
+        ):
+            raise HTTPException(status_code=403, detail=f"Already submitted form {form_id}")
+        if not aggregation_store.can_accept_feedback(department, form_id, db):
+            raise HTTPException(status_code=400, detail="Feedback limit reached")
+        return None
 
     dept_state = load_department_state(
-        department=user["department"],
-        form_id=payload.form_id,
+        department=department,
+        form_id=form_id,
         embedding_dim=EMBEDDING_DIM,
         max_clients=MAX_EMPLOYEES_PER_DEPT,
         db=db
     )
 
+    if has_submitted(user["email"], department, form_id, dept_state.cycle, db):
+        raise HTTPException(status_code=403, detail=f"Already submitted form {form_id}")
+
     if not dept_state.can_accept_feedback():
         raise HTTPException(status_code=400, detail="Feedback limit reached")
 
-    embedding = np.array(generate_embedding(payload.feedback_text))
-    dept_state.add_client_embedding(embedding)
-
-    save_department_state(user["department"], payload.form_id, dept_state, db)
+    return dept_state
+
+
+def _record_submission(payload: FeedbackRequest, user: dict, db: Session, embedding: np.ndarray, dept_state):
+    department = user["department"]
+    form_id = payload.form_id
+
+    try:
+        if aggregation_store is not None:
+            client_count = aggregation_store.add(user["email"], department, form_id, embedding, db)
+        else:
+            dept_state = submit_client_embedding(
+                email=user["email"],
+                department=department,
+                form_id=form_id,
+                embedding=embedding,
+                embedding_dim=EMBEDDING_DIM,
+                max_clients=MAX_EMPLOYEES_PER_DEPT,
+                db=db,
+                state=dept_state
+            )
+            client_count = dept_state.client_count if dept_state is not None else None
+    except DuplicateSubmissionError:
+        raise HTTPException(status_code=403, detail=f"Already submitted form {form_id}")
+    except StaleStateError:
+        raise HTTPException(status_code=409, detail="Too many concurrent submissions, please retry")
+
+    if client_count is None:
+        raise HTTPException(status_code=400, detail="Feedback limit reached")
 
-    setattr(db_user, submitted_field, True)
-    db.commit()
+    insights_cache.invalidate(department, form_id)
+    return client_count
 
-    del payload.feedback_text
-    del embedding
 
-    return {
-        "message": "Feedback aggregated successfully",
-        "submitted_count": dept_state.client_count
-    }
+def _check_top_k(top_k: int):
+    if not 1 <= top_k <= INSIGHT_MAX_TOP_K:
+        raise HTTPException(status_code=400, detail=f"top_k must be between 1 and {INSIGHT_MAX_TOP_K}")
 
 
 @app.get("/manager/insights/{department}/{form_id}")
 def get_department_insights(
     department: str,
     form_id: str,
+    top_k: int = INSIGHT_TOP_K,
     user=Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -119,9 +222,32 @@ def get_department_insights(
     if department != user["department"]:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    if form_id not in VALID_FORM_IDS:
+    if not form_exists(db, form_id):
         raise HTTPException(status_code=400, detail="Invalid form ID")
 
+    _check_top_k(top_k)
+
+    # Cheap version probe first; the embedding blob is only read on a cache miss
+    dept_state = load_department_states(
+        department=department,
+        form_ids=[form_id],
+        embedding_dim=EMBEDDING_DIM,
+        max_clients=MAX_EMPLOYEES_PER_DEPT,
+        db=db
+    )[form_id]
+
+    if dept_state.client_count == 0:
+        raise HTTPException(status_code=404, detail="No feedback yet")
+
+    # A new taxonomy version or a different top_k is a different response
+    taxonomy = resolve_taxonomy(department, form_id, db)
+    cache_version = (dept_state.version, taxonomy.scope, taxonomy.version, top_k)
+    cached = insights_cache.get(department, form_id, cache_version, dept_state.client_count)
+    if cached is not None:
+        count("insights_cache_hit")
+        return cached
+    count("insights_cache_miss")
+
     dept_state = load_department_state(
         department=department,
         form_id=form_id,
@@ -133,9 +259,9 @@ def get_department_insights(
     if dept_state.client_count == 0:
         raise HTTPException(status_code=404, detail="No feedback yet")
 
-    insights = generate_insights(dept_state.aggregated_embedding.tolist())
+    insights = generate_insights(dept_state.aggregated_embedding, taxonomy, top_k)
 
-    return {
+    response = {
         "department": department,
         "form_id": form_id,
         "num_employees": dept_state.client_count,
@@ -143,6 +269,88 @@ def get_department_insights(
         "status": "CLOSED" if dept_state.round_complete else "OPEN",
         "insights": insights
     }
+    cache_version = (dept_state.version, taxonomy.scope, taxonomy.version, top_k)
+    insights_cache.put(department, form_id, cache_version, dept_state.client_count, response)
+    return response
+
+
+@app.get("/insights/org/{form_id}")
+def get_org_insights(
+    form_id: str,
+    division: Optional[str] = None,
+    top_k: int = INSIGHT_TOP_K,
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Company-wide insights for a form, or one division's with ?division=."""
+    if user["role"] not in ("manager", "admin"):
+        raise HTTPException(status_code=403, detail="Only managers and admins can view org insights")
+
+    if not form_exists(db, form_id):
+        raise HTTPException(status_code=400, detail="Invalid form ID")
+
+    _check_top_k(top_k)
+
+    # One rollup row regardless of how many departments feed it
+    rollup = load_rollup(form_id, EMBEDDING_DIM, db, division=division)
+    if rollup.client_count == 0:
+        raise HTTPException(status_code=404, detail="No feedback yet")
+
+    cache_key = f"@{division_scope(division)}" if division is not None else f"@{COMPANY}"
+    taxonomy = resolve_taxonomy(None, form_id, db)
+    cache_version = (rollup.version, taxonomy.scope, taxonomy.version, top_k)
+    cached = insights_cache.get(cache_key, form_id, cache_version, rollup.client_count)
+    if cached is not None:
+        return cached
+
+    response = {
+        "scope": "division" if division is not None else "company",
+        "division": division,
+        "form_id": form_id,
+        "num_employees": rollup.client_count,
+        "insights": generate_insights(rollup.aggregated_embedding, taxonomy, top_k)
+    }
+    insights_cache.put(cache_key, form_id, cache_version, rollup.client_count, response)
+    return response
+
+
+@app.get("/manager/trends/{department}/{form_id}")
+def get_insight_trends(
+    department: str,
+    form_id: str,
+    cycles: int = TREND_DEFAULT_CYCLES,
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Anchor score series over the last closed cycles, read from archived snapshots."""
+    if user["role"] != "manager":
+        raise HTTPException(status_code=403, detail="Only managers can view trends")
+
+    if department != user["department"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    if not form_exists(db, form_id):
+        raise HTTPException(status_code=400, detail="Invalid form ID")
+
+    if not 1 <= cycles <= 100:
+        raise HTTPException(status_code=400, detail="cycles must be between 1 and 100")
+
+    snapshots = load_trend(department, form_id, db, limit=cycles)
+
+    # Snapshots keep only their top anchors; cycles where one fell out read None
+    series = {}
+    for i, snapshot in enumerate(snapshots):
+        for anchor, score in snapshot["scores"].items():
+            series.setdefault(anchor, [None] * len(snapshots))[i] = score
+
+    return {
+        "department": department,
+        "form_id": form_id,
+        "cycles": [s["cycle"] for s in snapshots],
+        "num_employees": [s["num_employees"] for s in snapshots],
+        "archived_at": [s["archived_at"] for s in snapshots],
+        "series": series,
+    }
 
 
 @app.get("/manager/forms/{department}")
@@ -157,21 +365,19 @@ def get_forms_overview(
     if department != user["department"]:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    FORM_NAMES = {
-        "1": "Manager Leadership Feedback",
-        "2": "Team Collaboration Survey",
-        "3": "Company Culture Assessment",
-    }
+    form_names = list_forms(db)
+
+    states = load_department_states(
+        department=department,
+        form_ids=form_names.keys(),
+        embedding_dim=EMBEDDING_DIM,
+        max_clients=MAX_EMPLOYEES_PER_DEPT,
+        db=db
+    )
 
     forms = []
-    for form_id, form_name in FORM_NAMES.items():
-        dept_state = load_department_state(
-            department=department,
-            form_id=form_id,
-            embedding_dim=EMBEDDING_DIM,
-            max_clients=MAX_EMPLOYEES_PER_DEPT,
-            db=db
-        )
+    for form_id, form_name in form_names.items():
+        dept_state = states[form_id]
         forms.append({
             "form_id": form_id,
             "form_name": form_name,
@@ -183,6 +389,15 @@ def get_forms_overview(
     return {"department": department, "forms": forms}
 
 
+@app.get("/admin/status")
+def get_org_status(user=Depends(get_current_user), db: Session = Depends(get_db)):
+    """Submission progress for every department and form in one response."""
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view org status")
+
+    return org_status(list_forms(db), MAX_EMPLOYEES_PER_DEPT, db)
+
+
 @app.post("/admin/reset/{department}/{form_id}")
 def reset_cycle(
     department: str,
@@ -196,14 +411,147 @@ def reset_cycle(
     if department != user["department"]:
         raise HTTPException(status_code=403, detail="Access denied")
 
-    if form_id not in VALID_FORM_IDS:
+    if not form_exists(db, form_id):
+        raise HTTPException(status_code=400, detail="Invalid form ID")
+
+    if aggregation_store is not None:
+        # Flush first so the archived snapshot includes unflushed submissions
+        aggregation_store.flush_and_discard(department, form_id)
+
+    # Bumping the cycle is the whole reset: earlier submissions belong to the old cycle
+    reset_department_state(department, form_id, EMBEDDING_DIM, db)
+    insights_cache.invalidate(department, form_id)
+
+    return {"message": f"New feedback cycle started for form {form_id} in {department}"}
+
+
+class FormCreateRequest(BaseModel):
+    form_id: str
+    name: str
+
+
+@app.get("/forms")
+def get_forms(user=Depends(get_current_user), db: Session = Depends(get_db)):
+    return [{"form_id": form_id, "form_name": name} for form_id, name in list_forms(db).items()]
+
+
+@app.post("/admin/forms")
+def register_form(
+    payload: FormCreateRequest,
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can create forms")
+
+    if not payload.form_id.strip() or not payload.name.strip():
+        raise HTTPException(status_code=400, detail="form_id and name are required")
+
+    try:
+        create_form(db, payload.form_id.strip(), payload.name.strip())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"status": "created", "form_id": payload.form_id.strip()}
+
+
+class DivisionAssignment(BaseModel):
+    division: Optional[str] = None
+
+
+@app.get("/admin/divisions")
+def get_divisions(user=Depends(get_current_user), db: Session = Depends(get_db)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view divisions")
+
+    return list_divisions(db)
+
+
+@app.put("/admin/divisions/{department}")
+def assign_division(
+    department: str,
+    payload: DivisionAssignment,
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can assign divisions")
+
+    division = payload.division.strip() if payload.division else None
+    set_department_division(department, division or None, EMBEDDING_DIM, db)
+
+    return {"department": department, "division": division or None}
+
+
+class TaxonomyRequest(BaseModel):
+    department: Optional[str] = None
+    form_id: Optional[str] = None
+    anchors: Dict[str, str]
+
+
+@app.get("/admin/taxonomies")
+def get_taxonomies(user=Depends(get_current_user), db: Session = Depends(get_db)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view taxonomies")
+
+    return list_taxonomies(db)
+
+
+@app.put("/admin/taxonomies")
+def put_taxonomy(
+    payload: TaxonomyRequest,
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Saves a new version of the anchor set for a department and/or form (neither = default)."""
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can edit taxonomies")
+
+    if payload.form_id is not None and not form_exists(db, payload.form_id):
         raise HTTPException(status_code=400, detail="Invalid form ID")
 
-    reset_department_state(department, form_id, db)
+    try:
+        return save_taxonomy(payload.anchors, db, department=payload.department, form_id=payload.form_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except TaxonomyConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-    submitted_field = f"submitted_form_{form_id}"
-    for emp in db.query(User).filter(User.department == department, User.role == "employee").all():
-        setattr(emp, submitted_field, False)
-    db.commit()
 
-    return {"message": f"New feedback cycle started for form {form_id} in {department}"}
\ No newline at end of file
+@app.delete("/admin/taxonomies")
+def delete_taxonomy(
+    department: Optional[str] = None,
+    form_id: Optional[str] = None,
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can edit taxonomies")
+
+    try:
+        return remove_taxonomy(db, department=department, form_id=form_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except TaxonomyConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/metrics")
+def get_metrics(request: Request):
+    """Prometheus text exposition. Guarded by METRICS_TOKEN when it is set."""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admin/stats")
+def get_runtime_stats(user=Depends(get_current_user)):
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can view stats")
+
+    return {
+        "insights_cache": insights_cache.stats(),
+        "encoder": get_batch_stats(),
+        "database": get_pool_stats(),
+    }
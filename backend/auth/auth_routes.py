@@ -1,12 +1,32 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import exists, func, select
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+import json
+import tempfile
 from auth.schemas import RegisterRequest, LoginRequest
-from auth.auth_utils import hash_password, verify_password, create_access_token
+from auth.auth_utils import hash_password, verify_password_async, create_access_token
 from auth.dependencies import get_current_user
-from database import get_db, User
+from auth.provisioning import provision_users, text_stream
+from database import get_db, SessionLocal, DepartmentState, User, Submission
+from fl_aggregation import current_submissions
+from forms import list_forms
+from metrics import stage
 
 router = APIRouter()
 
+USERS_PAGE_DEFAULT = 100
+USERS_PAGE_MAX = 1000
+EXPORT_PAGE_SIZE = 1000
+
+def submission_flags(form_ids, submitted) -> dict:
+    # Keeps the submitted_form_{id} keys the frontend reads, for every registered form
+    flags = {f"submitted_form_{form_id}": form_id in submitted for form_id in form_ids}
+    flags["submitted_forms"] = [form_id for form_id in form_ids if form_id in submitted]
+    return flags
+
 @router.post("/register")
 def register_user(
     payload: RegisterRequest,
@@ -23,54 +43,152 @@ def register_user(
         password=hash_password(payload.password),
         role=payload.role,
         department=payload.department,
-        submitted_form_1=False,
-        submitted_form_2=False,
-        submitted_form_3=False,
     )
     db.add(new_user)
     db.commit()
     return {"status": "registered"}
 
 
+@router.post("/users/bulk")
+async def bulk_register_users(
+    request: Request,
+    format: str = "csv",
+    db: Session = Depends(get_db),
+    user=Depends(get_current_user)
+):
+    """
+    Body is a CSV (email,password,role,department header) or JSONL upload.
+    Returns {"created", "existing", "errors": [{"row", "email", "error"}]}.
+    """
+    if user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can register users")
+    if format not in ("csv", "jsonl"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'jsonl'")
+
+    # Spool the upload (to disk past 8 MB) and import it chunk by chunk
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        return await run_in_threadpool(provision_users, text_stream(spool), format, db)
+
+
 @router.post("/login")
-def login_user(payload: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == payload.email).first()
-    if not user or not verify_password(payload.password, user.password):
+async def login_user(payload: LoginRequest, db: Session = Depends(get_db)):
+    with stage("user_lookup"):
+        user = await run_in_threadpool(db.query(User).filter(User.email == payload.email).first)
+    # bcrypt runs on the bounded password pool, not the request threadpool
+    if not user or not await verify_password_async(payload.password, user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_access_token({
         "email": user.email,
         "role": user.role,
         "department": user.department
     })
+    form_ids = await run_in_threadpool(list_forms, db)
+    submitted = await run_in_threadpool(current_submissions, db, [user.email])
     return {
         "access_token": token,
         "role": user.role,
         "department": user.department,
-        "submitted_form_1": user.submitted_form_1,
-        "submitted_form_2": user.submitted_form_2,
-        "submitted_form_3": user.submitted_form_3,
+        **submission_flags(form_ids, submitted.get(user.email, set())),
     }
 
 
+def _users_query(department=None, role=None, form_id=None, submitted=None):
+    # Only the listed columns are loaded; the password hash never leaves the DB
+    query = select(User.email, User.role, User.department).where(User.role != "admin")
+    if department is not None:
+        query = query.where(User.department == department)
+    if role is not None:
+        query = query.where(User.role == role)
+    if form_id is not None and submitted is not None:
+        current_cycle = func.coalesce(
+            select(DepartmentState.cycle)
+            .where(DepartmentState.department == User.department, DepartmentState.form_id == form_id)
+            .scalar_subquery(),
+            1,
+        )
+        has_row = exists().where(
+            Submission.email == User.email,
+            Submission.department == User.department,
+            Submission.form_id == form_id,
+            Submission.cycle == current_cycle,
+        )
+        query = query.where(has_row if submitted else ~has_row)
+    return query
+
+
+def _users_page(db: Session, query, cursor: Optional[str], limit: int):
+    """Returns (rows, next_cursor) for one keyset page ordered by email."""
+    if cursor is not None:
+        query = query.where(User.email > cursor)
+    rows = db.execute(query.order_by(User.email).limit(limit + 1)).all()
+    next_cursor = rows[limit - 1].email if len(rows) > limit else None
+    rows = rows[:limit]
+    form_ids = list_forms(db)
+    submitted = current_submissions(db, [r.email for r in rows]) if rows else {}
+    return [
+        {
+            "email": r.email,
+            "role": r.role,
+            "department": r.department,
+            **submission_flags(form_ids, submitted.get(r.email, set())),
+        }
+        for r in rows
+    ], next_cursor
+
+
+def _export_users(query):
+    # Own session: the request-scoped one may be closed before streaming ends
+    db = SessionLocal()
+    try:
+        cursor = None
+        while True:
+            rows, cursor = _users_page(db, query, cursor, EXPORT_PAGE_SIZE)
+            for row in rows:
+                yield json.dumps(row) + "\n"
+            if cursor is None:
+                break
+    finally:
+        db.close()
+
+
 @router.get("/users")
 def get_all_users(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = USERS_PAGE_DEFAULT,
+    department: Optional[str] = None,
+    role: Optional[str] = None,
+    form_id: Optional[str] = None,
+    submitted: Optional[bool] = None,
+    format: str = "json",
     db: Session = Depends(get_db),
     user=Depends(get_current_user)
 ):
+    """
+    Lists non-admin users ordered by email, one page at a time. Pass the
+    X-Next-Cursor response header back as ?cursor= for the next page; it is
+    absent on the last page. format=ndjson streams every matching user instead.
+    submitted=true|false filters on the current cycle of form_id.
+    """
     if user["role"] != "admin":
         raise HTTPException(status_code=403, detail="Only admins can view users")
-    users = db.query(User).filter(User.role != "admin").all()
-    return [
-        {
-            "email": u.email,
-            "role": u.role,
-            "department": u.department,
-            "submitted_form_1": u.submitted_form_1,
-            "submitted_form_2": u.submitted_form_2,
-            "submitted_form_3": u.submitted_form_3,
-        }
-        for u in users
-    ]
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'ndjson'")
+    if submitted is not None and form_id is None:
+        raise HTTPException(status_code=400, detail="submitted filter requires form_id")
+    if not 1 <= limit <= USERS_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {USERS_PAGE_MAX}")
+
+    query = _users_query(department, role, form_id, submitted)
+    if format == "ndjson":
+        return StreamingResponse(_export_users(query), media_type="application/x-ndjson")
+    rows, next_cursor = _users_page(db, query, cursor, limit)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
 
 
 @router.delete("/users/{email}")
@@ -84,6 +202,7 @@ def delete_user(
     db_user = db.query(User).filter(User.email == email).first()
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
+    db.query(Submission).filter(Submission.email == email).delete(synchronize_session=False)
     db.delete(db_user)
     db.commit()
     return {"status": "deleted"}
\ No newline at end of file
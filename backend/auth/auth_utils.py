@@ -1,9 +1,15 @@
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import time
 import jwt
 import os
-from fastapi import Depends, HTTPException
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import HTTPException
+
+from metrics import count, stage
 
 pwd_context = CryptContext(
     schemes=["bcrypt"],
@@ -13,13 +19,79 @@ pwd_context = CryptContext(
 
 SECRET_KEY = os.environ.get("SECRET_KEY", "super-secret-key")
 ALGORITHM = "HS256"
-security = HTTPBearer()
+
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_QUEUE_LIMIT = int(os.environ.get("PASSWORD_QUEUE_LIMIT", str(PASSWORD_WORKERS * 8)))
+TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+TOKEN_CACHE_TTL_S = float(os.environ.get("TOKEN_CACHE_TTL_S", "300"))
 
 def hash_password(password: str):
     return pwd_context.hash(password)
 
 def verify_password(password: str, hashed: str):
-    return pwd_context.verify(password, hashed)
+    with stage("password_verify"):
+        return pwd_context.verify(password, hashed)
+
+
+class PasswordPool:
+    """
+    Runs bcrypt on a fixed set of threads (bcrypt releases the GIL) and
+    refuses new work with 503 once PASSWORD_QUEUE_LIMIT checks are waiting,
+    so a login storm queues here instead of starving every other endpoint.
+    """
+
+    def __init__(self, workers: int = PASSWORD_WORKERS, queue_limit: int = PASSWORD_QUEUE_LIMIT):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    async def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HTTPException(status_code=503, detail="Too many login attempts, please retry shortly")
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self._slots.release()
+
+password_pool = PasswordPool()
+
+async def verify_password_async(password: str, hashed: str):
+    return await password_pool.run(verify_password, password, hashed)
+
+
+class TokenClaimsCache:
+    """
+    TTL-bounded LRU of verified token claims. An entry never outlives the
+    token's own exp, so an expired token is always re-decoded and rejected.
+    """
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_MAX_ENTRIES, ttl: float = TOKEN_CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # token -> (expires_at, claims)
+        self._lock = threading.Lock()
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return dict(entry[1])
+
+    def put(self, token: str, claims: dict):
+        expires_at = time.time() + self.ttl
+        if "exp" in claims:
+            expires_at = min(expires_at, float(claims["exp"]))
+        with self._lock:
+            self._entries[token] = (expires_at, dict(claims))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+token_cache = TokenClaimsCache()
 
 def create_access_token(data: dict, expires_minutes=60):
     to_encode = data.copy()
@@ -27,16 +99,17 @@ def create_access_token(data: dict, expires_minutes=60):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 def decode_access_token(token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    with stage("jwt_decode"):
+        payload = token_cache.get(token)
+        if payload is not None:
+            count("token_cache_hit")
+            return payload
+        count("token_cache_miss")
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(status_code=401, detail="Token expired")
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        token_cache.put(token, payload)
         return payload
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-):
-    token = credentials.credentials
-    return decode_access_token(token)
@@ -0,0 +1,141 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from auth.auth_utils import hash_password
+from auth.schemas import RegisterRequest
+from database import User
+
+PROVISION_CHUNK_SIZE = int(os.environ.get("PROVISION_CHUNK_SIZE", "1000"))
+PROVISION_HASH_WORKERS = int(os.environ.get("PROVISION_HASH_WORKERS", str(os.cpu_count() or 1)))
+PROVISIONABLE_ROLES = {"employee", "manager"}
+
+
+def iter_user_rows(stream, fmt: str):
+    """
+    Yields (row_number, dict) from a text stream of CSV (with a header line)
+    or JSONL. Rows that cannot be parsed are yielded as (row_number, error_str).
+    """
+    if fmt == "csv":
+        for row_number, row in enumerate(csv.DictReader(stream), start=1):
+            yield row_number, row
+    elif fmt == "jsonl":
+        for row_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, f"invalid JSON: {e.msg}"
+                continue
+            yield row_number, row if isinstance(row, dict) else "expected a JSON object"
+    else:
+        raise ValueError(f"Unsupported format {fmt!r}, expected 'csv' or 'jsonl'")
+
+
+class UserProvisioner:
+    """
+    Bulk user import: per chunk, one set-based query for existing emails,
+    bcrypt hashing spread over PROVISION_HASH_WORKERS processes, and one
+    batched insert plus commit.
+    """
+
+    def __init__(self, db: Session, chunk_size: int = PROVISION_CHUNK_SIZE, hash_workers: int = PROVISION_HASH_WORKERS):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.hash_workers = hash_workers
+        self._executor = None
+        self._seen = set()
+        self.report = {"created": 0, "existing": 0, "errors": []}
+
+    def _error(self, row_number: int, email, error: str):
+        self.report["errors"].append({"row": row_number, "email": email, "error": error})
+
+    def _hash_all(self, passwords):
+        if self.hash_workers <= 1 or len(passwords) < 2:
+            return [hash_password(p) for p in passwords]
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.hash_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        chunksize = max(1, len(passwords) // (self.hash_workers * 4))
+        return list(self._executor.map(hash_password, passwords, chunksize=chunksize))
+
+    def _provision_chunk(self, chunk):
+        valid = []
+        for row_number, row in chunk:
+            if isinstance(row, str):
+                self._error(row_number, None, row)
+                continue
+            try:
+                req = RegisterRequest.model_validate(row)
+            except ValidationError as e:
+                self._error(row_number, row.get("email"), "; ".join(
+                    f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()
+                ))
+                continue
+            email = req.email.strip()
+            if req.role not in PROVISIONABLE_ROLES:
+                self._error(row_number, email, f"role must be one of {sorted(PROVISIONABLE_ROLES)}")
+            elif not email or not req.password or not req.department:
+                self._error(row_number, email, "email, password and department are required")
+            elif email in self._seen:
+                self._error(row_number, email, "duplicate email in upload")
+            else:
+                self._seen.add(email)
+                valid.append((email, req))
+        if not valid:
+            return
+
+        existing = {
+            email for (email,) in
+            self.db.query(User.email).filter(User.email.in_([email for email, _ in valid]))
+        }
+        new_users = [(email, req) for email, req in valid if email not in existing]
+        self.report["existing"] += len(valid) - len(new_users)
+        if not new_users:
+            return
+
+        hashes = self._hash_all([req.password for _, req in new_users])
+        self.db.bulk_insert_mappings(User, [
+            {
+                "email": email,
+                "password": hashed,
+                "role": req.role,
+                "department": req.department,
+            }
+            for (email, req), hashed in zip(new_users, hashes)
+        ])
+        self.db.commit()
+        self.report["created"] += len(new_users)
+
+    def provision(self, rows) -> dict:
+        chunk = []
+        try:
+            for item in rows:
+                chunk.append(item)
+                if len(chunk) >= self.chunk_size:
+                    self._provision_chunk(chunk)
+                    chunk = []
+            if chunk:
+                self._provision_chunk(chunk)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        return self.report
+
+
+def provision_users(stream, fmt: str, db: Session, **kwargs) -> dict:
+    return UserProvisioner(db, **kwargs).provision(iter_user_rows(stream, fmt))
+
+
+def text_stream(binary) -> io.TextIOWrapper:
+    return io.TextIOWrapper(binary, encoding="utf-8", newline="")
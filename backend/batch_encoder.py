@@ -0,0 +1,148 @@
+# batch_encoder.py
+import os
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+import numpy as np
+
+from metrics import ENCODER_BATCH_SIZE, ENCODER_QUEUE_WAIT, METRICS_ENABLED, STAGE_SECONDS
+
+BATCH_WINDOW_MS = float(os.environ.get("EMBED_BATCH_WINDOW_MS", "5"))
+MAX_BATCH_SIZE = int(os.environ.get("EMBED_MAX_BATCH_SIZE", "32"))
+
+
+def _settle(future: Future, result=None, error: BaseException = None):
+    # Each future on its own: one that is already done must not strand its batch-mates
+    if future.done():
+        return
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class BatchEncoder:
+    """
+    Collects concurrent encode requests and runs them as one batch.
+
+    batch_fn(texts, epsilons) must return an array of shape (len(texts), dim),
+    or a concurrent.futures.Future resolving to one (e.g. from a process pool).
+    A batch is dispatched once MAX_BATCH_SIZE requests are waiting or the
+    first waiting request is BATCH_WINDOW_MS old, whichever comes first, and
+    at most max_in_flight batches run at a time.
+    """
+
+    def __init__(self, batch_fn, window_ms: float = BATCH_WINDOW_MS, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_in_flight: int = 1):
+        self.batch_fn = batch_fn
+        self.window = max(window_ms, 0.0) / 1000.0
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self._slots = threading.Semaphore(max(int(max_in_flight), 1))
+        self._pending = []  # (text, epsilon, enqueued_at, future)
+        self._cond = threading.Condition()
+        self._worker = None
+        self._batches = 0
+        self._requests = 0
+        self._largest_batch = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def submit(self, text: str, epsilon: float) -> Future:
+        future = Future()
+        with self._cond:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="batch-encoder", daemon=True)
+                self._worker.start()
+            self._pending.append((text, epsilon, time.perf_counter(), future))
+            self._cond.notify()
+        return future
+
+    def encode(self, text: str, epsilon: float) -> np.ndarray:
+        return self.submit(text, epsilon).result()
+
+    def _take_batch(self):
+        with self._cond:
+            while True:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = self._pending[0][2] + self.window
+                while len(self._pending) < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+                # Drop requests whose caller went away; the rest can no longer be cancelled
+                batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+                if batch:
+                    return batch
+
+    def _run(self):
+        while True:
+            # Wait for a free slot first so requests keep batching up meanwhile
+            self._slots.acquire()
+            batch = self._take_batch()
+            started = time.perf_counter()
+            texts = [item[0] for item in batch]
+            epsilons = [item[1] for item in batch]
+            try:
+                results = self.batch_fn(texts, epsilons)
+            except Exception as exc:
+                self._finish(batch, started, error=exc)
+                continue
+            if isinstance(results, Future):
+                results.add_done_callback(
+                    lambda f, batch=batch, started=started: self._resolve(batch, started, f)
+                )
+            else:
+                self._finish(batch, started, results=results)
+
+    def _resolve(self, batch, started: float, result: Future):
+        try:
+            results = result.result()
+        except BaseException as exc:
+            self._finish(batch, started, error=exc)
+            return
+        self._finish(batch, started, results=results)
+
+    def _finish(self, batch, started: float, error: Exception = None, results=None):
+        self._slots.release()
+        if error is not None:
+            for *_, future in batch:
+                _settle(future, error=error)
+            return
+        self._record(len(batch), [started - item[2] for item in batch], time.perf_counter() - started)
+        for row, (*_, future) in zip(results, batch):
+            _settle(future, result=row)
+
+    def _record(self, size: int, waits, elapsed: float):
+        if METRICS_ENABLED:
+            ENCODER_BATCH_SIZE.observe(size)
+            STAGE_SECONDS.observe(elapsed, "encode_batch")
+            for wait in waits:
+                ENCODER_QUEUE_WAIT.observe(wait)
+        with self._cond:
+            self._batches += 1
+            self._requests += size
+            self._largest_batch = max(self._largest_batch, size)
+            self._total_wait += sum(waits)
+            self._max_wait = max(self._max_wait, max(waits))
+
+    def stats(self) -> dict:
+        with self._cond:
+            batches = self._batches
+            requests = self._requests
+            return {
+                "batches": batches,
+                "requests": requests,
+                "queued": len(self._pending),
+                "mean_batch_size": round(requests / batches, 3) if batches else 0.0,
+                "max_batch_size": self._largest_batch,
+                "mean_queue_wait_ms": round(1000 * self._total_wait / requests, 3) if requests else 0.0,
+                "max_queue_wait_ms": round(1000 * self._max_wait, 3),
+            }
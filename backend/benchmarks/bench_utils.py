@@ -0,0 +1,107 @@
+# Shared helpers for the benchmark scripts in this directory.
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def latency_summary(samples, duration: float = None) -> dict:
+    """samples in seconds; duration (if given) adds a throughput figure."""
+    if not samples:
+        return {"count": 0}
+    summary = {
+        "count": len(samples),
+        "mean_ms": round(1000 * sum(samples) / len(samples), 3),
+        "p50_ms": round(1000 * percentile(samples, 50), 3),
+        "p95_ms": round(1000 * percentile(samples, 95), 3),
+        "p99_ms": round(1000 * percentile(samples, 99), 3),
+        "max_ms": round(1000 * max(samples), 3),
+    }
+    if duration:
+        summary["throughput_per_s"] = round(len(samples) / duration, 2)
+    return summary
+
+
+def time_calls(fn, repeat: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return latency_summary(samples, sum(samples))
+
+
+def run_metadata(config: dict) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+    }
+
+
+def compare(current: dict, baseline: dict, key: str = "p50_ms") -> dict:
+    """{name: current/baseline ratio of `key`} for every entry in both results."""
+    ratios = {}
+    for name, stats in current.items():
+        base = baseline.get(name)
+        if isinstance(stats, dict) and isinstance(base, dict) and stats.get(key) and base.get(key):
+            ratios[name] = round(stats[key] / base[key], 3)
+    return ratios
+
+
+def emit(report: dict, output: str = None, baseline: str = None, section: str = "results"):
+    if baseline:
+        with open(baseline) as f:
+            report["vs_baseline_p50"] = compare(report[section], json.load(f).get(section, {}))
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+def add_common_args(parser):
+    parser.add_argument("--output", default=None, help="also write the JSON report to this file")
+    parser.add_argument("--baseline", default=None, help="earlier JSON report to compare p50 latencies against")
+    return parser
+
+
+
+def install_stub_encoder(embedding_dim: int = 384, seed: int = 0):
+    """
+    Swaps the batch encoder's model call for random unit vectors so request
+    paths can be timed without model inference. The model is still loaded
+    once for the anchor embeddings (cached on disk after the first run).
+    """
+    import numpy as np
+    import embedding
+
+    rng = np.random.default_rng(seed)
+
+    def stub_batch(texts, epsilons):
+        vectors = rng.standard_normal((len(texts), embedding_dim))
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    embedding.batch_encoder.batch_fn = stub_batch
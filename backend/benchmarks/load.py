@@ -0,0 +1,165 @@
+# In-process load driver for api.app.
+#
+#   python benchmarks/load.py [--requests 2000] [--concurrency 32] [--encoder stub|real]
+#                             [--mix submit=4,insights=3,overview=2,login=1]
+#                             [--departments 20] [--output load.json] [--baseline old.json]
+#
+# Requests go through httpx's ASGI transport straight into the app (no
+# sockets) against a throwaway SQLite database. Prints one JSON report whose
+# "results" map each request type to latency percentiles and throughput.
+# Any env configuration (AGGREGATION_WRITE_BEHIND, ENCODER_PROCESSES, ...)
+# applies as it would in the server.
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from collections import Counter, deque
+
+from bench_utils import add_common_args, emit, install_stub_encoder, latency_summary, run_metadata
+
+PASSWORD = "password123"
+OK_STATUSES = {
+    "submit": {200},
+    "insights": {200, 404},  # 404 until a department/form has feedback
+    "overview": {200},
+    "login": {200},
+}
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OK_STATUSES:
+            raise SystemExit(f"unknown request type {name!r}, expected one of {sorted(OK_STATUSES)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def seed_users(departments: int, employees_per_dept: int):
+    from auth.auth_utils import create_access_token, hash_password
+    from database import SessionLocal, User
+
+    # One bcrypt hash shared by every user keeps setup fast; login still verifies it
+    hashed = hash_password(PASSWORD)
+    employees, managers = [], []
+    db = SessionLocal()
+    for d in range(departments):
+        department = f"dept{d}"
+        manager = f"manager@{department}.bench"
+        db.add(User(email=manager, password=hashed, role="manager", department=department))
+        managers.append((manager, department))
+        for e in range(employees_per_dept):
+            email = f"employee{e}@{department}.bench"
+            db.add(User(email=email, password=hashed, role="employee", department=department))
+            employees.append((email, department))
+    db.commit()
+    db.close()
+
+    def token(email, role, department):
+        return {"Authorization": "Bearer " + create_access_token(
+            {"email": email, "role": role, "department": department}
+        )}
+    employee_tokens = {email: token(email, "employee", dept) for email, dept in employees}
+    manager_tokens = {dept: token(email, "manager", dept) for email, dept in managers}
+    return employees, managers, employee_tokens, manager_tokens
+
+
+async def drive(client, args, mix, employees, managers, employee_tokens, manager_tokens, form_ids):
+    rng = random.Random(args.seed)
+    # Each (employee, form) pair can submit once per cycle
+    pending_submits = [(email, dept, form_id) for email, dept in employees for form_id in form_ids]
+    rng.shuffle(pending_submits)
+    pending_submits = deque(pending_submits)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    remaining = [args.requests]
+    samples = {name: [] for name in names}
+    statuses = {name: Counter() for name in names}
+
+    async def one(name):
+        if name == "submit":
+            if not pending_submits:
+                name = "insights"
+            else:
+                email, dept, form_id = pending_submits.popleft()
+                body = {"department": dept, "feedback_text": f"Feedback from {email} on form {form_id}.", "form_id": form_id}
+                return name, await client.post("/feedback/submit", json=body, headers=employee_tokens[email])
+        _, dept = rng.choice(managers)
+        if name == "insights":
+            return name, await client.get(f"/manager/insights/{dept}/{rng.choice(form_ids)}", headers=manager_tokens[dept])
+        if name == "overview":
+            return name, await client.get(f"/manager/forms/{dept}", headers=manager_tokens[dept])
+        email, _ = rng.choice(managers)
+        return name, await client.post("/auth/login", json={"email": email, "password": PASSWORD})
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            start = time.perf_counter()
+            name, response = await one(rng.choices(names, weights)[0])
+            samples.setdefault(name, []).append(time.perf_counter() - start)
+            statuses.setdefault(name, Counter())[response.status_code] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    duration = time.perf_counter() - start
+
+    results = {}
+    for name, times in samples.items():
+        if not times:
+            continue
+        stats = latency_summary(times, duration)
+        stats["errors"] = sum(n for code, n in statuses[name].items() if code not in OK_STATUSES[name])
+        stats["status_codes"] = {str(code): n for code, n in sorted(statuses[name].items())}
+        results[name] = stats
+    all_times = [t for times in samples.values() for t in times]
+    results["all"] = latency_summary(all_times, duration)
+    results["all"]["duration_s"] = round(duration, 3)
+    results["all"]["errors"] = sum(stats["errors"] for name, stats in results.items() if name != "all")
+    return results
+
+
+async def run(args) -> dict:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "load.db")
+    try:
+        import httpx
+    except ImportError:
+        raise SystemExit("benchmarks/load.py needs httpx (pip install httpx)")
+    import api
+    from database import SessionLocal
+    from forms import list_forms
+
+    if args.encoder == "stub":
+        install_stub_encoder(api.EMBEDDING_DIM)
+
+    async with api.app.router.lifespan_context(api.app):
+        employees, managers, employee_tokens, manager_tokens = seed_users(
+            args.departments, args.employees_per_department
+        )
+        with SessionLocal() as db:
+            form_ids = list(list_forms(db))
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            return await drive(client, args, parse_mix(args.mix), employees, managers,
+                               employee_tokens, manager_tokens, form_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", default="submit=4,insights=3,overview=2,login=1")
+    parser.add_argument("--encoder", choices=("stub", "real"), default="stub")
+    parser.add_argument("--departments", type=int, default=20)
+    parser.add_argument("--employees-per-department", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    add_common_args(parser)
+    args = parser.parse_args()
+
+    report = run_metadata({k: v for k, v in vars(args).items() if k not in ("output", "baseline")})
+    report["results"] = asyncio.run(run(args))
+    emit(report, args.output, args.baseline)
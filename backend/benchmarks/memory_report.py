@@ -0,0 +1,147 @@
+# Memory footprint of serve.py as workers are added.
+#
+#   python benchmarks/memory_report.py [--workers 1,2,4] [--submits-per-worker 8]
+#                                      [--output mem.json] [--baseline old.json]
+#
+# For each worker count, starts serve.py against a throwaway SQLite database,
+# sends some feedback submissions so every worker has encoded, then reads
+# /proc/<pid>/smaps_rollup for the master and each worker. Per-worker RSS
+# counts the shared model pages in full; private_mb and the growth of
+# total_pss_mb per added worker are what each extra worker really costs.
+# Linux only.
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_utils import BACKEND_DIR, add_common_args, compare, emit, run_metadata
+
+PASSWORD = "password123"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def worker_pids(master_pid: int) -> list:
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def seed_employees(prefix: str, count: int) -> list:
+    """[(department, headers)], spread so no department passes its submission cap."""
+    from api import MAX_EMPLOYEES_PER_DEPT
+    from auth.auth_utils import create_access_token, hash_password
+    from database import SessionLocal, User
+
+    hashed = hash_password(PASSWORD)
+    users = [(f"{prefix}-{i // MAX_EMPLOYEES_PER_DEPT}", f"employee{i}@{prefix}.bench") for i in range(count)]
+    db = SessionLocal()
+    db.add_all(User(email=email, password=hashed, role="employee", department=department) for department, email in users)
+    db.commit()
+    db.close()
+    return [
+        (department, {"Authorization": "Bearer " + create_access_token(
+            {"email": email, "role": "employee", "department": department}
+        )})
+        for department, email in users
+    ]
+
+
+def wait_ready(client, master, workers: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if master.poll() is not None:
+            raise SystemExit(f"serve.py exited with {master.returncode}")
+        try:
+            if len(worker_pids(master.pid)) == workers and client.get("/openapi.json").status_code == 200:
+                return
+        except Exception:
+            pass
+        time.sleep(0.25)
+    raise SystemExit(f"serve.py not ready after {timeout}s")
+
+
+def measure(workers: int, args) -> dict:
+    import httpx
+    from serve import memory_report
+
+    port = free_port()
+    env = dict(os.environ, HOST="127.0.0.1", PORT=str(port), WEB_CONCURRENCY=str(workers), LOG_LEVEL="warning")
+    tokens = seed_employees(f"mem{workers}", workers * args.submits_per_worker)
+
+    master = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, "serve.py")], cwd=BACKEND_DIR, env=env)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            wait_ready(client, master, workers, args.startup_timeout)
+            idle = memory_report(master.pid, worker_pids(master.pid))
+
+            def submit(token):
+                department, headers = token
+                body = {"department": department, "feedback_text": "The team supports each other well.", "form_id": "1"}
+                return client.post("/feedback/submit", json=body, headers=headers).status_code
+
+            with ThreadPoolExecutor(max_workers=workers * 2) as pool:
+                statuses = list(pool.map(submit, tokens))
+            # Every worker must have encoded, or the warm numbers understate it
+            failed = [status for status in statuses if status != 200]
+            if failed:
+                raise SystemExit(f"{len(failed)} of {len(statuses)} submissions failed: {sorted(set(failed))}")
+            time.sleep(args.settle)
+            warm = memory_report(master.pid, worker_pids(master.pid))
+    finally:
+        master.terminate()
+        master.wait(timeout=60)
+
+    private = [w["private_mb"] for w in warm["workers"]]
+    return {
+        "idle": idle,
+        "warm": warm,
+        "submits": len(statuses),
+        "worker_rss_mb_mean": round(sum(w["rss_mb"] for w in warm["workers"]) / workers, 1),
+        "worker_private_mb_mean": round(sum(private) / workers, 1),
+        "worker_private_mb_max": max(private),
+        "total_pss_mb": warm["total_pss_mb"],
+    }
+
+
+def summarize(results: dict) -> dict:
+    """Growth in total PSS per added worker between consecutive runs."""
+    runs = sorted((int(name.split("=")[1]), stats) for name, stats in results.items())
+    marginal = {}
+    for (n0, a), (n1, b) in zip(runs, runs[1:]):
+        marginal[f"{n0}->{n1}"] = round((b["total_pss_mb"] - a["total_pss_mb"]) / (n1 - n0), 1)
+    return {
+        "master_rss_mb": runs[0][1]["warm"]["master"]["rss_mb"] if runs else None,
+        "marginal_pss_mb_per_worker": marginal,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--submits-per-worker", type=int, default=8)
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds to wait after the submissions")
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    add_common_args(parser)
+    args = parser.parse_args()
+
+    # One throwaway database for every run; each run seeds its own department
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "mem.db")
+    from database import init_db
+    init_db()
+
+    report = run_metadata({k: v for k, v in vars(args).items() if k not in ("output", "baseline")})
+    report["results"] = {f"workers={n}": measure(n, args) for n in (int(w) for w in args.workers.split(","))}
+    report["summary"] = summarize(report["results"])
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["vs_baseline_total_pss"] = compare(report["results"], json.load(f)["results"], key="total_pss_mb")
+    emit(report, args.output)
@@ -0,0 +1,86 @@
+# Micro-benchmarks for the per-request hot paths.
+#
+#   python benchmarks/micro.py [--encoder stub|real] [--repeat 200] [--output micro.json] [--baseline old.json]
+#
+# Prints one JSON report; "results" maps each benchmark to latency stats in ms.
+# Pass an earlier report as --baseline to get current/baseline p50 ratios.
+import argparse
+import os
+import tempfile
+
+from bench_utils import add_common_args, emit, install_stub_encoder, run_metadata, time_calls
+
+EMBEDDING_DIM = 384
+
+
+def run(repeat: int, encoder: str) -> dict:
+    os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "micro.db"))
+    import numpy as np
+    from anchor_embeddings import normalize_rows
+    from auth import auth_utils
+    from auth.auth_utils import TokenClaimsCache, create_access_token, decode_access_token, hash_password, verify_password
+    from embedding import generate_embedding, generate_embeddings
+    from fl_aggregation import DepartmentFLState
+    from insights import generate_insights, generate_insights_batch
+    from taxonomies import Taxonomy
+
+    if encoder == "stub":
+        install_stub_encoder(EMBEDDING_DIM)
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1000, EMBEDDING_DIM))
+    results = {}
+
+    results["generate_embedding"] = time_calls(lambda: generate_embedding("The team communicates well."), repeat)
+    if encoder == "real":
+        texts = ["The team communicates well."] * 32
+        results["generate_embeddings_batch32"] = time_calls(lambda: generate_embeddings(texts, [5.0] * 32), max(repeat // 10, 5))
+
+    state = DepartmentFLState(EMBEDDING_DIM, max_clients=10**9)
+    i = iter(range(10**9))
+    results["add_client_embedding"] = time_calls(lambda: state.add_client_embedding(vectors[next(i) % 1000]), repeat * 10)
+
+    other = DepartmentFLState(EMBEDDING_DIM, max_clients=10**9)
+    for v in vectors[:100]:
+        other.add_client_embedding(v)
+    results["merge"] = time_calls(lambda: state.merge(other), repeat * 10)
+
+    blob = state.to_bytes()
+    results["aggregate_to_bytes"] = time_calls(state.to_bytes, repeat * 10)
+    results["aggregate_load_bytes"] = time_calls(lambda: state.load_bytes(blob), repeat * 10)
+
+    mean = state.aggregated_embedding
+    results["generate_insights"] = time_calls(lambda: generate_insights(mean), repeat * 10)
+    results["generate_insights_batch100"] = time_calls(lambda: generate_insights_batch(vectors[:100]), repeat)
+    for n in (1000, 5000):
+        taxonomy = Taxonomy("bench", n, [f"anchor{k}" for k in range(n)], normalize_rows(rng.standard_normal((n, EMBEDDING_DIM))))
+        results[f"generate_insights_{n}_anchors"] = time_calls(lambda: generate_insights(mean, taxonomy), repeat * 10)
+
+    hashed = hash_password("password123")
+    auth_repeat = max(repeat // 20, 5)  # bcrypt is deliberately slow
+    results["hash_password"] = time_calls(lambda: hash_password("password123"), auth_repeat, warmup=1)
+    results["verify_password"] = time_calls(lambda: verify_password("password123", hashed), auth_repeat, warmup=1)
+
+    claims = {"email": "bench@bench.local", "role": "employee", "department": "bench"}
+    results["create_access_token"] = time_calls(lambda: create_access_token(claims), repeat * 10)
+    token = create_access_token(claims)
+    cached = auth_utils.token_cache
+    results["decode_access_token_cached"] = time_calls(lambda: decode_access_token(token), repeat * 10)
+
+    # A zero-size cache drops every entry on put, so each call re-verifies the JWT
+    auth_utils.token_cache = TokenClaimsCache(max_entries=0)
+    results["decode_access_token_uncached"] = time_calls(lambda: decode_access_token(token), repeat * 10)
+    auth_utils.token_cache = cached
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--encoder", choices=("stub", "real"), default="real")
+    add_common_args(parser)
+    args = parser.parse_args()
+
+    report = run_metadata({"repeat": args.repeat, "encoder": args.encoder})
+    report["results"] = run(args.repeat, args.encoder)
+    emit(report, args.output, args.baseline)
@@ -0,0 +1,85 @@
+# Stress test for optimistic aggregation into a single DepartmentState row.
+#
+#   python benchmarks/stress_aggregation.py --clients 50
+#
+# N threads submit one embedding each to the same department/form at once,
+# through submit_client_embedding (the same path as /feedback/submit);
+# the final row must have client_count == N and the exact mean (to float32
+# precision), and the company rollup must match it.
+import argparse
+import os
+import sys
+import tempfile
+import threading
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+EMBEDDING_DIM = 384
+
+
+def run(clients: int, database_url: str):
+    os.environ["DATABASE_URL"] = database_url
+    import numpy as np
+    from database import SessionLocal, User, init_db
+    from fl_aggregation import load_department_state, submit_client_embedding
+    from rollups import load_rollup
+
+    init_db()
+    db = SessionLocal()
+    db.add_all(User(email=f"stress{i}@bench.local", password="x", role="employee", department="stress") for i in range(clients))
+    db.commit()
+    db.close()
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((clients, EMBEDDING_DIM))
+    barrier = threading.Barrier(clients)
+    errors = []
+
+    def submit(i):
+        db = SessionLocal()
+        try:
+            barrier.wait()
+            state = submit_client_embedding(
+                f"stress{i}@bench.local", "stress", "1", embeddings[i], EMBEDDING_DIM, clients, db,
+                max_retries=clients * 4,
+            )
+            if state is None:
+                errors.append(f"client {i}: round rejected feedback")
+        except Exception as e:
+            errors.append(f"client {i}: {e!r}")
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    db = SessionLocal()
+    state = load_department_state("stress", "1", EMBEDDING_DIM, clients, db)
+    rollup = load_rollup("1", EMBEDDING_DIM, db)
+    db.close()
+
+    max_error = float(np.abs(state.aggregated_embedding - embeddings.mean(axis=0)).max())
+    rollup_error = float(np.abs(rollup.aggregated_embedding - state.aggregated_embedding).max())
+    print(f"clients={clients} client_count={state.client_count} version={state.version} max_abs_error={max_error:.2e} "
+          f"rollup_count={rollup.client_count} rollup_error={rollup_error:.2e}")
+    for e in errors:
+        print("ERROR", e)
+    return (
+        not errors and state.client_count == clients and max_error < 1e-6
+        and rollup.client_count == clients and rollup_error < 1e-6
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--database-url", default=None, help="defaults to a throwaway SQLite file")
+    args = parser.parse_args()
+
+    url = args.database_url
+    if url is None:
+        url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "stress.db")
+    sys.exit(0 if run(args.clients, url) else 1)
@@ -0,0 +1,91 @@
+# Per-submit DB latency: the original multi-commit path vs the fused upsert.
+#
+#   python benchmarks/submit_db.py --submits 200
+#
+# Encoding is left out; each submit gets a random 384-d embedding so only
+# the database work is timed.
+import argparse
+import os
+import tempfile
+import time
+
+from bench_utils import add_common_args, emit, latency_summary, run_metadata
+
+EMBEDDING_DIM = 384
+
+
+def legacy_submit(db, email, department, form_id, embedding):
+    # Mirrors submit_feedback before the fused path: user lookup, state load,
+    # state save with its own re-query and commit, then the submission commit.
+    import numpy as np
+    from database import DepartmentState, Submission, User
+    from fl_aggregation import load_department_state, _single, _state_id, _update_rollups
+
+    db.query(User).filter(User.email == email).first()
+    state = load_department_state(department, form_id, EMBEDDING_DIM, 10**9, db)
+    state.add_client_embedding(embedding)
+
+    sid = _state_id(department, form_id)
+    db_row = db.query(DepartmentState).filter(DepartmentState.id == sid).first()
+    if not db_row:
+        db_row = DepartmentState(id=sid, department=department, form_id=form_id)
+        db.add(db_row)
+    db_row.client_count = state.client_count
+    db_row.round_complete = state.round_complete
+    db_row.aggregated_embedding = state.aggregated_embedding.astype(np.float64).tobytes()
+    # Same rollup maintenance as the fused path, so only the commit pattern differs
+    _update_rollups(department, form_id, _single(embedding, EMBEDDING_DIM), db)
+    db.commit()
+
+    db.add(Submission(email=email, department=department, form_id=form_id, cycle=state.cycle))
+    db.commit()
+
+
+def fused_submit(db, email, department, form_id, embedding):
+    from database import User
+    from fl_aggregation import has_submitted, load_department_state, submit_client_embedding
+
+    db.query(User).filter(User.email == email).first()
+    state = load_department_state(department, form_id, EMBEDDING_DIM, 10**9, db)
+    has_submitted(email, department, form_id, state.cycle, db)
+    submit_client_embedding(email, department, form_id, embedding, EMBEDDING_DIM, 10**9, db, state=state)
+
+
+def run(submits: int, database_url: str):
+    os.environ["DATABASE_URL"] = database_url
+    import numpy as np
+    from database import SessionLocal, User, init_db
+
+    init_db()
+    rng = np.random.default_rng(0)
+    db = SessionLocal()
+    results = {}
+    for name, submit, department in (("legacy", legacy_submit, "bench_legacy"), ("fused", fused_submit, "bench_fused")):
+        emails = [f"{name}{i}@bench.local" for i in range(submits)]
+        db.add_all(User(email=e, password="x", role="employee", department=department) for e in emails)
+        db.commit()
+        samples = []
+        for email in emails:
+            embedding = rng.standard_normal(EMBEDDING_DIM)
+            start = time.perf_counter()
+            submit(db, email, department, "1", embedding)
+            samples.append(time.perf_counter() - start)
+        results[name] = latency_summary(samples, sum(samples))
+    db.close()
+    results["speedup_mean"] = round(results["legacy"]["mean_ms"] / results["fused"]["mean_ms"], 2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--submits", type=int, default=200)
+    parser.add_argument("--database-url", default=None, help="defaults to a throwaway SQLite file")
+    add_common_args(parser)
+    args = parser.parse_args()
+
+    url = args.database_url
+    if url is None:
+        url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    report = run_metadata({"submits": args.submits, "database": url.split(":", 1)[0]})
+    report["results"] = run(args.submits, url)
+    emit(report, args.output, args.baseline)
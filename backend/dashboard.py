@@ -0,0 +1,71 @@
+# dashboard.py
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from metrics import timed
+
+
+@timed("org_status")
+def org_status(form_names: dict, max_employees: int, db: Session) -> dict:
+    """
+    Department x form submission counts and OPEN/CLOSED status for the whole
+    org. Two column-only queries (users grouped by department, and the
+    department_states counters); no ORM objects or embedding blobs are loaded.
+    """
+    from database import DepartmentState, User
+    people = db.execute(
+        select(
+            User.department,
+            func.sum(case((User.role == "employee", 1), else_=0)).label("employees"),
+            func.sum(case((User.role == "manager", 1), else_=0)).label("managers"),
+        ).where(User.role != "admin").group_by(User.department)
+    ).all()
+    states = db.execute(
+        select(
+            DepartmentState.department,
+            DepartmentState.form_id,
+            DepartmentState.client_count,
+            DepartmentState.round_complete,
+            DepartmentState.cycle,
+        ).where(DepartmentState.form_id.in_(list(form_names)))
+    ).all()
+
+    departments = {
+        row.department: {"employees": int(row.employees or 0), "managers": int(row.managers or 0), "forms": {}}
+        for row in people
+    }
+    for row in states:
+        entry = departments.setdefault(row.department, {"employees": 0, "managers": 0, "forms": {}})
+        entry["forms"][row.form_id] = (row.client_count or 0, bool(row.round_complete), row.cycle)
+
+    totals = {form_id: {"submissions": 0, "closed": 0} for form_id in form_names}
+    rows = []
+    for department in sorted(departments):
+        entry = departments[department]
+        forms = {}
+        for form_id in form_names:
+            submissions, closed, cycle = entry["forms"].get(form_id, (0, False, 1))
+            forms[form_id] = {
+                "num_submissions": submissions,
+                "status": "CLOSED" if closed else "OPEN",
+                "cycle": cycle,
+            }
+            totals[form_id]["submissions"] += submissions
+            totals[form_id]["closed"] += closed
+        rows.append({
+            "department": department,
+            "employees": entry["employees"],
+            "managers": entry["managers"],
+            "forms": forms,
+        })
+
+    return {
+        "forms": [{"form_id": form_id, "form_name": name} for form_id, name in form_names.items()],
+        "max_employees": max_employees,
+        "totals": {
+            "departments": len(rows),
+            "employees": sum(row["employees"] for row in rows),
+            "forms": totals,
+        },
+        "departments": rows,
+    }
@@ -1,15 +1,20 @@
-from sqlalchemy import create_engine, Column, String, Boolean, Integer, LargeBinary
+from sqlalchemy import create_engine, inspect, text, Column, String, Boolean, Integer, LargeBinary, DateTime, Index, JSON
 from sqlalchemy.orm import declarative_base, sessionmaker
+from datetime import datetime
 import os
+import re
+
+from metrics import instrument_engine
+from storage import configure_engine, engine_options, pool_stats
 
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./secureview.db")
 
 if DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
+engine = create_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+configure_engine(engine)
+instrument_engine(engine)
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
@@ -19,9 +24,11 @@ class User(Base):
     password = Column(String, nullable=False)
     role = Column(String, nullable=False)
     department = Column(String, nullable=False)
-    submitted_form_1 = Column(Boolean, default=False)
-    submitted_form_2 = Column(Boolean, default=False)
-    submitted_form_3 = Column(Boolean, default=False)
+    __table_args__ = (
+        # Keyset pages of /auth/users filtered by department walk this in email order
+        Index("ix_users_department_email", "department", "email"),
+        Index("ix_users_department_role", "department", "role"),
+    )
 
 class DepartmentState(Base):
     __tablename__ = "department_states"
@@ -31,9 +38,146 @@ class DepartmentState(Base):
     client_count = Column(Integer, default=0)
     round_complete = Column(Boolean, default=False)
     aggregated_embedding = Column(LargeBinary, nullable=True)
+    version = Column(Integer, nullable=False, default=0, server_default="0")  # bumped on every write
+    cycle = Column(Integer, nullable=False, default=1, server_default="1")  # bumped on every reset
+    __table_args__ = (
+        Index("ix_department_states_department_form", "department", "form_id"),
+    )
+
+class InsightSnapshot(Base):
+    # Append-only: one row per closed cycle, written by reset_department_state
+    __tablename__ = "insight_snapshots"
+    department = Column(String, primary_key=True)
+    form_id = Column(String, primary_key=True)
+    cycle = Column(Integer, primary_key=True)
+    client_count = Column(Integer, nullable=False)
+    aggregated_embedding = Column(LargeBinary, nullable=True)
+    anchor_scores = Column(JSON, nullable=False)  # {anchor: cosine score}
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class RollupState(Base):
+    # Company and division aggregates, kept in step with department_states.
+    # Split over rollups.NUM_SHARDS rows per scope (a department always writes
+    # the same shard) so submits don't all queue on one row; readers sum them.
+    __tablename__ = "rollup_shards"
+    scope = Column(String, primary_key=True)  # "company" or "division:{name}"
+    form_id = Column(String, primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    client_count = Column(Integer, nullable=False, default=0)
+    aggregated_embedding = Column(LargeBinary, nullable=True)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+
+class DepartmentDivision(Base):
+    __tablename__ = "department_divisions"
+    department = Column(String, primary_key=True)
+    division = Column(String, nullable=False, index=True)
+
+class AnchorSet(Base):
+    # One row per taxonomy version; the highest version of a scope is the active one
+    __tablename__ = "anchor_sets"
+    scope = Column(String, primary_key=True)  # "default", "department:{d}", "form:{f}" or "department:{d}|form:{f}"
+    version = Column(Integer, primary_key=True)
+    model_name = Column(String, nullable=False)  # encoder the embeddings came from
+    anchor_count = Column(Integer, nullable=False)  # 0 = removed, fall back to the next scope
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Anchor(Base):
+    __tablename__ = "anchors"
+    scope = Column(String, primary_key=True)
+    version = Column(Integer, primary_key=True)
+    position = Column(Integer, primary_key=True)
+    key = Column(String, nullable=False)
+    text = Column(String, nullable=False)
+    embedding = Column(LargeBinary, nullable=False)  # unit-length float32
+
+class Form(Base):
+    __tablename__ = "forms"
+    id = Column(String, primary_key=True)
+    name = Column(String, nullable=False)
+    position = Column(Integer, nullable=False, default=0)  # display order
+
+class Submission(Base):
+    # One row per (user, form, cycle); "already submitted" is a primary-key lookup
+    __tablename__ = "submissions"
+    email = Column(String, primary_key=True)
+    department = Column(String, primary_key=True)
+    form_id = Column(String, primary_key=True)
+    cycle = Column(Integer, primary_key=True)
+    submitted_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_submissions_department_form_cycle", "department", "form_id", "cycle"),
+    )
+
+DEFAULT_FORMS = {
+    "1": "Manager Leadership Feedback",
+    "2": "Team Collaboration Survey",
+    "3": "Company Culture Assessment",
+}
+
+def _add_missing_columns():
+    # create_all() never alters existing tables, so add new nullable/defaulted columns here
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+
+def _create_missing_indexes():
+    # Same story for indexes declared on tables that already existed
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+def _seed_default_forms():
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT COUNT(*) FROM forms")).scalar():
+            return
+        conn.execute(
+            Form.__table__.insert(),
+            [{"id": k, "name": v, "position": i} for i, (k, v) in enumerate(DEFAULT_FORMS.items())],
+        )
+
+def _migrate_submitted_flags():
+    # Move legacy users.submitted_form_N flags into submissions for the
+    # current cycle, then clear them so the copy happens exactly once
+    legacy = sorted(
+        c["name"] for c in inspect(engine).get_columns("users")
+        if re.fullmatch(r"submitted_form_\d+", c["name"])
+    )
+    with engine.begin() as conn:
+        for column in legacy:
+            form_id = column.rsplit("_", 1)[1]
+            conn.execute(text(f"""
+                INSERT INTO submissions (email, department, form_id, cycle)
+                SELECT u.email, u.department, :form_id, COALESCE(ds.cycle, 1)
+                FROM users u
+                LEFT JOIN department_states ds
+                    ON ds.department = u.department AND ds.form_id = :form_id
+                WHERE u.{column} = :flag AND NOT EXISTS (
+                    SELECT 1 FROM submissions s
+                    WHERE s.email = u.email AND s.department = u.department
+                      AND s.form_id = :form_id AND s.cycle = COALESCE(ds.cycle, 1)
+                )
+            """), {"form_id": form_id, "flag": True})
+            conn.execute(text(f"UPDATE users SET {column} = NULL WHERE {column} IS NOT NULL"))
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    _create_missing_indexes()
+    _seed_default_forms()
+    _migrate_submitted_flags()
+
+def get_pool_stats():
+    return pool_stats(engine)
 
 def get_db():
     db = SessionLocal()
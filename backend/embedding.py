@@ -1,23 +1,57 @@
 # embedding.py
-from sentence_transformers import SentenceTransformer
+import asyncio
+
 import numpy as np
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+from batch_encoder import BatchEncoder
+from encoder_pool import EncoderPool, pool_enabled
+from metrics import stage
+from model_registry import get_model
 
-def clip_embedding(embedding: np.ndarray, max_norm: float = 1.0):
-    norm = np.linalg.norm(embedding)
-    if norm > max_norm:
-        embedding = embedding * (max_norm / norm)
-    return embedding
+def clip_embeddings(embeddings: np.ndarray, max_norm: float = 1.0):
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    scale = np.minimum(1.0, max_norm / np.maximum(norms, 1e-12))
+    return embeddings * scale
 
-def add_laplace_noise(embedding: np.ndarray, epsilon: float):
-    scale = 1.0 / epsilon
+def add_laplace_noise(embedding: np.ndarray, epsilon):
+    # epsilon may be a scalar or an (n, 1) array with one budget per row
+    scale = 1.0 / np.asarray(epsilon, dtype=np.float64)
     noise = np.random.laplace(loc=0.0, scale=scale, size=embedding.shape)
     return embedding + noise
 
+def generate_embeddings(texts, epsilons):
+    # In ENCODER_PROCESSES workers these stages are recorded in the worker, not scraped
+    with stage("model_encode"):
+        embeddings = np.asarray(get_model().encode(texts, batch_size=len(texts)), dtype=np.float64)
+    with stage("dp_noise"):
+        embeddings = clip_embeddings(embeddings, max_norm=1.0)
+        epsilons = np.asarray(epsilons, dtype=np.float64).reshape(-1, 1)
+        return add_laplace_noise(embeddings, epsilons)
+
+# With ENCODER_PROCESSES > 0 batches are encoded in worker processes
+encoder_pool = EncoderPool() if pool_enabled() else None
+
+batch_encoder = BatchEncoder(
+    encoder_pool.submit_batch if encoder_pool else generate_embeddings,
+    max_in_flight=encoder_pool.processes if encoder_pool else 1,
+)
+
 def generate_embedding(text: str, epsilon: float = 5.0):  # increased from 1.0
-    embedding = model.encode(text)
-    embedding = np.array(embedding)
-    embedding = clip_embedding(embedding, max_norm=1.0)
-    dp_embedding = add_laplace_noise(embedding, epsilon)
-    return dp_embedding.tolist()
\ No newline at end of file
+    dp_embedding = batch_encoder.encode(text, epsilon)
+    return dp_embedding.tolist()
+
+async def generate_embedding_async(text: str, epsilon: float = 5.0):
+    # Awaits the batch without holding a threadpool thread
+    dp_embedding = await asyncio.wrap_future(batch_encoder.submit(text, epsilon))
+    return dp_embedding.tolist()
+
+def get_batch_stats():
+    return batch_encoder.stats()
+
+def start_encoder():
+    if encoder_pool is not None:
+        encoder_pool.start()
+
+def shutdown_encoder():
+    if encoder_pool is not None:
+        encoder_pool.shutdown()
@@ -0,0 +1,89 @@
+# encoder_pool.py
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+ENCODER_PROCESSES = int(os.environ.get("ENCODER_PROCESSES", "0"))  # 0 = encode in the API process
+ENCODER_TORCH_THREADS = int(os.environ.get("ENCODER_TORCH_THREADS", "1"))
+
+
+# Set in pool workers before they import embedding, whose module-level
+# ENCODER_PROCESSES (inherited from the parent) would otherwise start a pool
+_in_worker = False
+
+
+def pool_enabled(processes: int = ENCODER_PROCESSES) -> bool:
+    # Workers must encode locally, never start a pool of their own
+    return processes > 0 and not _in_worker
+
+
+def _init_worker(torch_threads: int):
+    global _in_worker
+    _in_worker = True
+    import torch
+    torch.set_num_threads(torch_threads)
+    from model_registry import get_model
+    get_model()
+
+
+def _ready():
+    return os.getpid()
+
+
+def _encode_batch(texts, epsilons):
+    from embedding import generate_embeddings
+    return generate_embeddings(texts, epsilons)
+
+
+class EncoderPool:
+    """
+    Pool of worker processes, each holding one model copy, that encode and
+    noise batches off the API process's GIL.
+    """
+
+    def __init__(self, processes: int = ENCODER_PROCESSES, torch_threads: int = ENCODER_TORCH_THREADS):
+        self.processes = processes
+        self.torch_threads = torch_threads
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    # spawn, not fork: forking after torch has started threads can deadlock
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.torch_threads,),
+                )
+            return self._executor
+
+    def start(self):
+        # Spawn every worker and load its model before the first request
+        executor = self._get_executor()
+        for future in [executor.submit(_ready) for _ in range(self.processes)]:
+            future.result()
+
+    def submit_batch(self, texts, epsilons):
+        executor = self._get_executor()
+        try:
+            return executor.submit(_encode_batch, texts, epsilons)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed): replace the pool instead of failing every later batch
+            self._replace(executor)
+            return self._get_executor().submit(_encode_batch, texts, epsilons)
+
+    def _replace(self, broken: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -1,13 +1,50 @@
+import random
+import time
+
 import numpy as np
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, defer
+
+from aggregate_codec import AGGREGATE_DTYPE, decode_aggregate, encode_aggregate
+from metrics import count, stage, timed
+
+MAX_SAVE_RETRIES = 8
+
+
+class StaleStateError(Exception):
+    """Another writer updated the department state since it was loaded."""
+
+
+class DuplicateSubmissionError(Exception):
+    """The user has already submitted this form."""
+
 
 class DepartmentFLState:
-    def __init__(self, embedding_dim: int, max_clients: int):
+    """
+    Running aggregate of client embeddings, kept as a Kahan-compensated sum
+    plus a count. Adding an embedding or merging another state updates the
+    buffers in place; aggregated_embedding (the mean) is computed on read.
+    """
+
+    def __init__(self, embedding_dim: int, max_clients: int, dtype=AGGREGATE_DTYPE):
         self.embedding_dim = embedding_dim
         self.max_clients = max_clients
         self.client_count = 0
         self.round_complete = False
-        self.aggregated_embedding = np.zeros(embedding_dim)
+        self._sum = np.zeros(embedding_dim, dtype=dtype)
+        self._comp = np.zeros(embedding_dim, dtype=dtype)  # low-order bits lost from _sum
+        self._y = np.empty(embedding_dim, dtype=dtype)
+        self._t = np.empty(embedding_dim, dtype=dtype)
+        self.version = None  # row version this state was loaded at, None if no row yet
+        self.cycle = 1  # feedback cycle; submissions are recorded against it
+
+    @property
+    def aggregated_embedding(self) -> np.ndarray:
+        if self.client_count == 0:
+            return np.zeros(self.embedding_dim)
+        return (self._sum.astype(np.float64) - self._comp) / self.client_count
 
     def can_accept_feedback(self):
         return (
@@ -15,60 +52,346 @@ class DepartmentFLState:
             self.client_count < self.max_clients
         )
 
+    def _accumulate(self, value, correction=None, negate: bool = False):
+        # Kahan step: _sum += ±(value - correction), carrying rounding error in _comp
+        y, t = self._y, self._t
+        if negate:
+            np.add(value, self._comp, out=y)
+            np.negative(y, out=y)
+            if correction is not None:
+                np.add(y, correction, out=y)
+        else:
+            np.subtract(value, self._comp, out=y)
+            if correction is not None:
+                np.subtract(y, correction, out=y)
+        np.add(self._sum, y, out=t)
+        np.subtract(t, self._sum, out=self._comp)
+        np.subtract(self._comp, y, out=self._comp)
+        # t now holds the new sum; recycle the old sum buffer as scratch
+        self._sum, self._t = t, self._sum
+
     def add_client_embedding(self, embedding: np.ndarray):
         if self.round_complete:
             raise ValueError("FL round already completed")
+        self._accumulate(embedding)
         self.client_count += 1
-        lr = 1 / self.client_count
-        self.aggregated_embedding = (
-            (1 - lr) * self.aggregated_embedding + lr * embedding
-        )
         if self.client_count >= self.max_clients:
             self.round_complete = True
 
+    def merge(self, other: "DepartmentFLState"):
+        # Sums add directly, so merging partial aggregates is a single O(dim) pass
+        if other.client_count == 0:
+            return
+        self._accumulate(other._sum, other._comp)
+        self.client_count += other.client_count
+        if self.client_count >= self.max_clients:
+            self.round_complete = True
+
+    def unmerge(self, other: "DepartmentFLState"):
+        # Inverse of merge, e.g. to take a department back out of a rollup
+        if other.client_count == 0:
+            return
+        self._accumulate(other._sum, other._comp, negate=True)
+        self.client_count -= other.client_count
+        if self.client_count <= 0:
+            self.client_count = 0
+            self._sum.fill(0)
+            self._comp.fill(0)
+        self.round_complete = self.client_count >= self.max_clients
+
     def reset_for_next_round(self):
         self.client_count = 0
         self.round_complete = False
-        self.aggregated_embedding = np.zeros(self.embedding_dim)
+        self._sum.fill(0)
+        self._comp.fill(0)
+
+    def to_bytes(self) -> bytes:
+        return encode_aggregate(self._sum, self._comp, self.client_count)
+
+    def load_bytes(self, blob: bytes):
+        total, compensation = decode_aggregate(blob, self.embedding_dim, self.client_count)
+        np.copyto(self._sum, total, casting="same_kind")
+        np.copyto(self._comp, compensation, casting="same_kind")
 
 
 def _state_id(department: str, form_id: str) -> str:
     return f"{department}_{form_id}"
 
 
+def _single(embedding: np.ndarray, embedding_dim: int) -> DepartmentFLState:
+    delta = DepartmentFLState(embedding_dim=embedding_dim, max_clients=1)
+    delta.add_client_embedding(embedding)
+    return delta
+
+
+@timed("rollup_update")
+def _update_rollups(department: str, form_id: str, delta: DepartmentFLState, db: Session, subtract: bool = False):
+    from rollups import apply_rollup_delta
+    apply_rollup_delta(department, form_id, delta, db, subtract=subtract)
+
+
+@timed("load_state")
 def load_department_state(department: str, form_id: str, embedding_dim: int, max_clients: int, db: Session) -> DepartmentFLState:
     from database import DepartmentState
     state = DepartmentFLState(embedding_dim=embedding_dim, max_clients=max_clients)
     db_row = db.query(DepartmentState).filter(
         DepartmentState.id == _state_id(department, form_id)
-    ).first()
+    ).populate_existing().first()
     if db_row:
-        state.client_count = db_row.client_count
-        state.round_complete = db_row.round_complete
-        if db_row.aggregated_embedding:
-            state.aggregated_embedding = np.frombuffer(db_row.aggregated_embedding, dtype=np.float64).copy()
+        _apply_row(state, db_row)
     return state
 
 
-def save_department_state(department: str, form_id: str, state: DepartmentFLState, db: Session):
+def _apply_row(state: DepartmentFLState, db_row, with_embedding: bool = True):
+    state.client_count = db_row.client_count
+    state.round_complete = db_row.round_complete
+    state.version = db_row.version
+    state.cycle = db_row.cycle
+    if with_embedding and db_row.aggregated_embedding:
+        state.load_bytes(db_row.aggregated_embedding)
+
+
+@timed("load_states")
+def load_department_states(
+    department: str,
+    form_ids,
+    embedding_dim: int,
+    max_clients: int,
+    db: Session,
+    with_embedding: bool = False,
+) -> dict:
+    """
+    Loads the states for several forms of one department in a single IN query.
+    Returns {form_id: DepartmentFLState}. Unless with_embedding is set the
+    embedding blob is never fetched and aggregated_embedding is left at zeros.
+    """
+    from database import DepartmentState
+    form_ids = list(form_ids)
+    states = {
+        form_id: DepartmentFLState(embedding_dim=embedding_dim, max_clients=max_clients)
+        for form_id in form_ids
+    }
+    query = db.query(DepartmentState).filter(
+        DepartmentState.id.in_([_state_id(department, form_id) for form_id in form_ids])
+    )
+    if not with_embedding:
+        query = query.options(defer(DepartmentState.aggregated_embedding))
+    for db_row in query.populate_existing():
+        if db_row.form_id in states:
+            _apply_row(states[db_row.form_id], db_row, with_embedding)
+    return states
+
+
+def _state_values(state: DepartmentFLState) -> dict:
+    return {
+        "client_count": state.client_count,
+        "round_complete": state.round_complete,
+        "aggregated_embedding": state.to_bytes(),
+    }
+
+
+@timed("save_state")
+def save_department_state(department: str, form_id: str, state: DepartmentFLState, db: Session, commit: bool = True):
+    """
+    Compare-and-swap write: only succeeds if the row is still at state.version.
+    Raises StaleStateError (after rolling back) when another writer got there first.
+    With commit=False the write joins the caller's transaction.
+    """
     from database import DepartmentState
     sid = _state_id(department, form_id)
-    db_row = db.query(DepartmentState).filter(DepartmentState.id == sid).first()
-    if not db_row:
-        db_row = DepartmentState(id=sid, department=department, form_id=form_id)
-        db.add(db_row)
-    db_row.client_count = state.client_count
-    db_row.round_complete = state.round_complete
-    db_row.aggregated_embedding = state.aggregated_embedding.astype(np.float64).tobytes()
-    db.commit()
+    values = _state_values(state)
+    try:
+        if state.version is None:
+            db.add(DepartmentState(id=sid, department=department, form_id=form_id, version=1, **values))
+            db.flush()
+            if commit:
+                db.commit()
+            state.version = 1
+            return
+        result = db.execute(
+            update(DepartmentState)
+            .where(DepartmentState.id == sid, DepartmentState.version == state.version)
+            .values(version=DepartmentState.version + 1, **values)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            raise StaleStateError(sid)
+        if commit:
+            db.commit()
+        state.version += 1
+    except IntegrityError:
+        db.rollback()
+        raise StaleStateError(sid)
+    except StaleStateError:
+        db.rollback()
+        raise
 
 
-def reset_department_state(department: str, form_id: str, db: Session):
+@timed("upsert_state")
+def upsert_department_state(department: str, form_id: str, state: DepartmentFLState, db: Session):
+    """
+    Versioned write as a single INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+    on PostgreSQL and SQLite; other dialects fall back to save_department_state.
+    Does not commit. Raises StaleStateError (after rolling back) on a version conflict.
+    """
     from database import DepartmentState
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        dialect_insert = postgresql.insert
+    elif dialect == "sqlite":
+        dialect_insert = sqlite.insert
+    else:
+        save_department_state(department, form_id, state, db, commit=False)
+        return
+
     sid = _state_id(department, form_id)
-    db_row = db.query(DepartmentState).filter(DepartmentState.id == sid).first()
-    if db_row:
-        db_row.client_count = 0
-        db_row.round_complete = False
-        db_row.aggregated_embedding = None
-        db.commit()
\ No newline at end of file
+    values = _state_values(state)
+    table = DepartmentState.__table__
+    stmt = dialect_insert(table).values(id=sid, department=department, form_id=form_id, version=1, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={**values, "version": table.c.version + 1},
+        # A missing row was expected: any existing row means we lost the race
+        where=table.c.version == (state.version if state.version is not None else -1),
+    ).returning(table.c.version)
+    row = db.execute(stmt).first()
+    if row is None:
+        db.rollback()
+        raise StaleStateError(sid)
+    state.version = row.version
+
+
+@timed("has_submitted")
+def has_submitted(email: str, department: str, form_id: str, cycle: int, db: Session) -> bool:
+    from database import Submission
+    return db.get(Submission, (email, department, form_id, cycle)) is not None
+
+
+def current_submissions(db: Session, emails=None) -> dict:
+    """
+    Returns {email: set(form_ids)} of submissions in each form's current cycle
+    for the user's current department. emails=None means every user.
+    """
+    from database import DepartmentState, Submission, User
+    query = (
+        db.query(Submission.email, Submission.form_id)
+        .join(User, and_(User.email == Submission.email, User.department == Submission.department))
+        .outerjoin(DepartmentState, and_(
+            DepartmentState.department == Submission.department,
+            DepartmentState.form_id == Submission.form_id,
+        ))
+        .filter(Submission.cycle == func.coalesce(DepartmentState.cycle, 1))
+    )
+    if emails is not None:
+        query = query.filter(Submission.email.in_(list(emails)))
+    submitted = {}
+    for email, form_id in query:
+        submitted.setdefault(email, set()).add(form_id)
+    return submitted
+
+
+@timed("record_submissions")
+def record_submissions(emails, department: str, form_id: str, cycle: int, db: Session):
+    """Inserts submission rows without committing; duplicates raise IntegrityError."""
+    from database import Submission
+    db.execute(
+        insert(Submission),
+        [{"email": email, "department": department, "form_id": form_id, "cycle": cycle} for email in emails]
+    )
+
+
+@timed("record_submissions")
+def record_new_submissions(emails, department: str, form_id: str, cycle: int, db: Session) -> set:
+    """
+    Inserts submission rows without committing, skipping users who already
+    have one for this cycle. Returns the emails that were actually inserted.
+    """
+    from database import Submission
+    emails = list(emails)
+    if not emails:
+        return set()
+    rows = [{"email": email, "department": department, "form_id": form_id, "cycle": cycle} for email in emails]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = dialect_insert(Submission).values(rows).on_conflict_do_nothing().returning(Submission.email)
+        return {row.email for row in db.execute(stmt)}
+    new = [row for row in rows if db.get(Submission, (row["email"], department, form_id, cycle)) is None]
+    if new:
+        db.execute(insert(Submission), new)
+    return {row["email"] for row in new}
+
+
+def submit_client_embedding(
+    email: str,
+    department: str,
+    form_id: str,
+    embedding: np.ndarray,
+    embedding_dim: int,
+    max_clients: int,
+    db: Session,
+    state: DepartmentFLState = None,
+    max_retries: int = MAX_SAVE_RETRIES,
+):
+    """
+    Fused submit: records the user's submission for the current cycle and
+    upserts the running aggregate in one transaction with one commit.
+    Returns the saved state, or None if the round can no longer accept feedback.
+    Raises DuplicateSubmissionError if the user already submitted this cycle.
+    """
+    for attempt in range(max_retries):
+        if state is None:
+            state = load_department_state(department, form_id, embedding_dim, max_clients, db)
+        if not state.can_accept_feedback():
+            db.rollback()
+            return None
+        try:
+            record_submissions([email], department, form_id, state.cycle, db)
+        except IntegrityError:
+            db.rollback()
+            count("duplicate_submission")
+            raise DuplicateSubmissionError(email)
+        state.add_client_embedding(embedding)
+        try:
+            # A concurrent reset bumps the version too, so a stale cycle can't commit
+            upsert_department_state(department, form_id, state, db)
+            _update_rollups(department, form_id, _single(embedding, embedding_dim), db)
+            with stage("commit"):
+                db.commit()
+            return state
+        except StaleStateError:
+            count("stale_retry")
+            state = None
+            time.sleep(random.uniform(0, 0.002 * (attempt + 1)))
+    raise StaleStateError(_state_id(department, form_id))
+
+
+@timed("reset_state")
+def reset_department_state(department: str, form_id: str, embedding_dim: int, db: Session):
+    from database import DepartmentState
+    sid = _state_id(department, form_id)
+    # Touch the row first so it stays locked while its aggregate is archived
+    # and taken out of the rollups
+    touched = db.execute(
+        update(DepartmentState)
+        .where(DepartmentState.id == sid)
+        .values(version=DepartmentState.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if touched.rowcount:
+        from history import archive_snapshot
+        state = load_department_state(department, form_id, embedding_dim, 1, db)
+        archive_snapshot(department, form_id, state, db)
+        _update_rollups(department, form_id, state, db, subtract=True)
+    db.execute(
+        update(DepartmentState)
+        .where(DepartmentState.id == sid)
+        .values(
+            client_count=0,
+            round_complete=False,
+            aggregated_embedding=None,
+            cycle=DepartmentState.cycle + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
@@ -0,0 +1,140 @@
+# fl_rounds.py
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+FL_ROUND_SIZE = int(os.environ.get("FL_ROUND_SIZE", "2"))
+FL_ROUND_TIMEOUT_S = float(os.environ.get("FL_ROUND_TIMEOUT_S", "300"))
+FL_ROUND_PATH = os.environ.get(
+    "FL_ROUND_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "fl_round.bin"),
+)
+
+MAGIC = b"SVFR"
+FORMAT_VERSION = 1
+# magic, format version, dim, updates in the open round, closed rounds,
+# open round start time, clients in the last closed round
+_HEADER = struct.Struct("<4sIIQQdQ")
+
+
+class SharedRound:
+    """
+    Running-sum federated averaging whose round state lives in a small
+    memory-mapped file, so every worker process on the host shares one round.
+
+    The file holds a header, the float64 sum of the open round's updates and
+    the last closed round's average: O(dim) regardless of how many clients
+    report. Updates are folded in place under an flock, and a round closes
+    once it has round_size updates or is timeout seconds old.
+    """
+
+    def __init__(self, path: str = FL_ROUND_PATH, round_size: int = FL_ROUND_SIZE, timeout: float = FL_ROUND_TIMEOUT_S):
+        self.path = path
+        self.round_size = max(int(round_size), 1)
+        self.timeout = timeout
+        self._thread_lock = threading.Lock()  # flock doesn't exclude threads sharing one descriptor
+        self._lock_fd = None
+        self._mm = None
+        self._dim = None
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            if self._lock_fd is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._lock_fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _map(self, dim: int = None) -> bool:
+        # Caller holds the lock. Creates the file on first use when dim is known.
+        if self._mm is not None:
+            return True
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < _HEADER.size:
+            if dim is None:
+                return False
+            with open(self.path, "wb") as f:
+                f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, dim, 0, 0, 0.0, 0))
+                f.truncate(_HEADER.size + 2 * dim * 8)
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            self._mm = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        magic, version, self._dim = _HEADER.unpack_from(self._mm)[:3]
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{self.path} is not a round state file")
+        return True
+
+    def _header(self):
+        _, _, dim, count, rounds, started_at, last_count = _HEADER.unpack_from(self._mm)
+        return dim, count, rounds, started_at, last_count
+
+    def _write_header(self, count: int, rounds: int, started_at: float, last_count: int):
+        _HEADER.pack_into(self._mm, 0, MAGIC, FORMAT_VERSION, self._dim, count, rounds, started_at, last_count)
+
+    def _arrays(self):
+        values = np.frombuffer(self._mm, dtype="<f8", count=2 * self._dim, offset=_HEADER.size)
+        return values[:self._dim], values[self._dim:]
+
+    def _close_round(self, count: int, rounds: int) -> np.ndarray:
+        total, last = self._arrays()
+        np.divide(total, count, out=last)
+        total.fill(0)
+        self._write_header(0, rounds + 1, 0.0, count)
+        return last.copy()
+
+    def add(self, update) -> tuple:
+        """
+        Folds one client update into the open round.
+        Returns (clients in the round so far, global average if this update
+        closed the round else None).
+        """
+        update = np.asarray(update, dtype=np.float64).ravel()
+        with self._locked():
+            self._map(update.shape[0])
+            if update.shape[0] != self._dim:
+                raise ValueError(f"Update has {update.shape[0]} values, round expects {self._dim}")
+            _, count, rounds, started_at, last_count = self._header()
+            total, _ = self._arrays()
+            total += update
+            count += 1
+            if count == 1:
+                started_at = time.time()
+            if count >= self.round_size or time.time() - started_at >= self.timeout:
+                return count, self._close_round(count, rounds)
+            self._write_header(count, rounds, started_at, last_count)
+            return count, None
+
+    def close_if_expired(self):
+        """Closes an open round older than the timeout; returns its average or None."""
+        with self._locked():
+            if not self._map():
+                return None
+            _, count, rounds, started_at, _ = self._header()
+            if count == 0 or time.time() - started_at < self.timeout:
+                return None
+            return self._close_round(count, rounds)
+
+    def status(self) -> dict:
+        with self._locked():
+            if not self._map():
+                return {"rounds_completed": 0, "pending_clients": 0, "round_age_s": 0.0, "last_round_clients": 0, "global_model": None}
+            _, count, rounds, started_at, last_count = self._header()
+            _, last = self._arrays()
+            return {
+                "rounds_completed": rounds,
+                "pending_clients": count,
+                "round_age_s": round(time.time() - started_at, 3) if count else 0.0,
+                "last_round_clients": last_count,
+                "global_model": last.tolist() if rounds else None,
+            }
@@ -0,0 +1,47 @@
+# forms.py
+import os
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Form
+
+FORMS_CACHE_TTL_S = float(os.environ.get("FORMS_CACHE_TTL_S", "30"))
+
+_cache = {"expires_at": 0.0, "forms": None}
+_lock = threading.Lock()
+
+
+def list_forms(db: Session) -> dict:
+    """Returns {form_id: form_name} in display order, cached for FORMS_CACHE_TTL_S."""
+    with _lock:
+        if _cache["forms"] is not None and _cache["expires_at"] > time.monotonic():
+            return _cache["forms"]
+    forms = {
+        form_id: name
+        for form_id, name in db.query(Form.id, Form.name).order_by(Form.position, Form.id)
+    }
+    with _lock:
+        _cache["forms"] = forms
+        _cache["expires_at"] = time.monotonic() + FORMS_CACHE_TTL_S
+    return forms
+
+
+def form_exists(db: Session, form_id: str) -> bool:
+    return form_id in list_forms(db)
+
+
+def create_form(db: Session, form_id: str, name: str):
+    if db.get(Form, form_id) is not None:
+        raise ValueError(f"Form {form_id} already exists")
+    position = (db.query(func.max(Form.position)).scalar() or 0) + 1
+    db.add(Form(id=form_id, name=name, position=position))
+    db.commit()
+    invalidate_forms_cache()
+
+
+def invalidate_forms_cache():
+    with _lock:
+        _cache["forms"] = None
@@ -0,0 +1,64 @@
+# history.py
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from fl_aggregation import DepartmentFLState
+
+TREND_DEFAULT_CYCLES = 12
+
+
+def archive_snapshot(department: str, form_id: str, state: DepartmentFLState, db: Session):
+    """
+    Appends the closing cycle's aggregate, count and top INSIGHT_TOP_K anchor
+    scores (under the taxonomy in effect) to insight_snapshots. Joins the
+    caller's transaction (no commit).
+    """
+    from database import InsightSnapshot
+    from insights import INSIGHT_TOP_K, anchor_scores, top_k_indices
+    from taxonomies import resolve_taxonomy
+    if state.client_count == 0:
+        return
+    taxonomy = resolve_taxonomy(department, form_id, db)
+    scores = anchor_scores(state.aggregated_embedding, taxonomy.matrix)[0]
+    top = sorted(top_k_indices(scores, INSIGHT_TOP_K))
+    db.add(InsightSnapshot(
+        department=department,
+        form_id=form_id,
+        cycle=state.cycle,
+        client_count=state.client_count,
+        aggregated_embedding=state.to_bytes(),
+        anchor_scores={taxonomy.keys[i]: round(float(scores[i]), 6) for i in top},
+        archived_at=datetime.utcnow(),
+    ))
+    db.flush()
+
+
+def load_trend(department: str, form_id: str, db: Session, limit: int = TREND_DEFAULT_CYCLES) -> list:
+    """
+    Returns the last `limit` archived cycles, oldest first, as
+    [{"cycle", "num_employees", "archived_at", "scores"}]. The embedding
+    blob is never read.
+    """
+    from database import InsightSnapshot
+    rows = db.execute(
+        select(
+            InsightSnapshot.cycle,
+            InsightSnapshot.client_count,
+            InsightSnapshot.archived_at,
+            InsightSnapshot.anchor_scores,
+        )
+        .where(InsightSnapshot.department == department, InsightSnapshot.form_id == form_id)
+        .order_by(InsightSnapshot.cycle.desc())
+        .limit(limit)
+    ).all()
+    return [
+        {
+            "cycle": row.cycle,
+            "num_employees": row.client_count,
+            "archived_at": row.archived_at.isoformat() if row.archived_at else None,
+            "scores": row.anchor_scores,
+        }
+        for row in reversed(rows)
+    ]
@@ -1,16 +1,48 @@
+import os
+
 import numpy as np
-from anchor_embeddings import ANCHOR_EMBEDDINGS
+from anchor_embeddings import ANCHOR_MATRIX
+from metrics import stage
+from taxonomies import BUILTIN_TAXONOMY
+
+INSIGHT_TOP_K = int(os.environ.get("INSIGHT_TOP_K", "10"))
+INSIGHT_MAX_TOP_K = 100
+TOP_DRIVERS = 3
 
 # -------------------------
 # Utils
 # -------------------------
-def cosine_similarity(a, b):
-    a = np.array(a)
-    b = np.array(b)
-    denom = (np.linalg.norm(a) * np.linalg.norm(b))
-    if denom == 0:
-        return 0.0
-    return float(np.dot(a, b) / denom)
+def anchor_scores(embeddings, matrix: np.ndarray = ANCHOR_MATRIX) -> np.ndarray:
+    """
+    embeddings: (N, dim) array-like of aggregated embeddings
+    matrix: (num_anchors, dim) unit-length anchor rows
+    returns: (N, num_anchors) cosine similarities against matrix
+    """
+    embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    # Zero vectors score 0.0 against every anchor
+    unit = np.divide(embeddings, norms, out=np.zeros_like(embeddings), where=norms > 0)
+    return unit @ matrix.T
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, ties in anchor order. O(n + k log k)."""
+    n = scores.shape[0]
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def score_summary(scores: np.ndarray) -> dict:
+    return {
+        "anchors": int(scores.shape[0]),
+        "mean": round(float(scores.mean()), 3),
+        "std": round(float(scores.std()), 3),
+        "min": round(float(scores.min()), 3),
+        "max": round(float(scores.max()), 3),
+    }
 
 
 def confidence_label(score: float):
@@ -34,19 +66,14 @@ def explanation_text(dimension: str, score: float):
 # -------------------------
 # Main Insight Generator
 # -------------------------
-def generate_insights(aggregated_embedding):
+def _format_insights(scores: np.ndarray, taxonomy, top_k: int):
     insights = {}
 
-    scores = []
-
-    for dimension, anchor_embedding in ANCHOR_EMBEDDINGS.items():
-        score = cosine_similarity(aggregated_embedding, anchor_embedding)
-        scores.append((dimension, score))
+    # Only the top_k anchors are ranked and explained, however large the taxonomy
+    order = top_k_indices(scores, top_k)
+    ranked = [(taxonomy.keys[i], float(scores[i])) for i in order]
 
-    # Sort dimensions by strength
-    scores.sort(key=lambda x: x[1], reverse=True)
-
-    for dimension, score in scores:
+    for dimension, score in ranked:
         insights[dimension] = {
             "score": round(score, 3),
             "confidence": confidence_label(score),
@@ -54,6 +81,20 @@ def generate_insights(aggregated_embedding):
         }
 
     return {
-        "top_drivers": [dim for dim, _ in scores[:3]],
-        "dimensions": insights
+        "top_drivers": [dim for dim, _ in ranked[:TOP_DRIVERS]],
+        "dimensions": insights,
+        "summary": score_summary(scores),
+        "taxonomy": {"scope": taxonomy.scope, "version": taxonomy.version},
     }
+
+
+def generate_insights_batch(aggregated_embeddings, taxonomy=BUILTIN_TAXONOMY, top_k: int = INSIGHT_TOP_K):
+    # One matrix multiply for all N embeddings
+    with stage("anchor_scores"):
+        scores = anchor_scores(aggregated_embeddings, taxonomy.matrix)
+    with stage("format_insights"):
+        return [_format_insights(row, taxonomy, top_k) for row in scores]
+
+
+def generate_insights(aggregated_embedding, taxonomy=BUILTIN_TAXONOMY, top_k: int = INSIGHT_TOP_K):
+    return generate_insights_batch([aggregated_embedding], taxonomy, top_k)[0]
@@ -0,0 +1,76 @@
+# insights_cache.py
+import json
+import os
+import threading
+from collections import OrderedDict
+
+INSIGHTS_CACHE_MAX_ENTRIES = int(os.environ.get("INSIGHTS_CACHE_MAX_ENTRIES", "1024"))
+INSIGHTS_CACHE_MAX_BYTES = int(os.environ.get("INSIGHTS_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+
+class InsightsCache:
+    """
+    LRU cache of insight responses per (department, form_id).
+
+    Each entry remembers the state version and client_count it was computed
+    from; a lookup only hits if both still match, so a stale entry is never
+    served even if another worker wrote the state.
+    """
+
+    def __init__(self, max_entries: int = INSIGHTS_CACHE_MAX_ENTRIES, max_bytes: int = INSIGHTS_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (department, form_id) -> (version, client_count, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, department: str, form_id: str, version, client_count: int):
+        key = (department, form_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or entry[1] != client_count:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[3]
+
+    def put(self, department: str, form_id: str, version, client_count: int, value: dict):
+        key = (department, form_id)
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (version, client_count, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[2]
+                self.evictions += 1
+
+    def invalidate(self, department: str, form_id: str):
+        with self._lock:
+            entry = self._entries.pop((department, form_id), None)
+            if entry is not None:
+                self._bytes -= entry[2]
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,234 @@
+# metrics.py
+import bisect
+import contextvars
+import functools
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # if set, /metrics requires this bearer token
+PREFIX = "secureview_"
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50, 100)
+
+_registry = []
+_gauges = []
+
+
+def _label_text(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in sorted(items):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = PREFIX + name + "_total"
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+def register_gauge(name: str, help_text: str, fn):
+    """fn() is called at scrape time and returns the current value."""
+    _gauges.append((PREFIX + name, help_text, fn))
+
+
+STAGE_SECONDS = Histogram("stage_seconds", "Time spent in each request pipeline stage.", ("stage",))
+REQUEST_SECONDS = Histogram("http_request_seconds", "HTTP request latency.", ("method", "route", "status"))
+DB_ROUND_TRIPS = Histogram(
+    "db_round_trips_per_request", "Statements plus commits sent to the database per request.", ("route",),
+    buckets=ROUND_TRIP_BUCKETS,
+)
+DB_STATEMENTS = Counter("db_statements", "Statements and commits sent to the database.", ("kind",))
+ENCODER_BATCH_SIZE = Histogram("encoder_batch_size", "Texts per encoder batch.", buckets=BATCH_SIZE_BUCKETS)
+ENCODER_QUEUE_WAIT = Histogram("encoder_queue_wait_seconds", "Time a text waited for its encoder batch to start.")
+EVENTS = Counter("events", "Notable request outcomes (duplicates, conflicts, cache hits...).", ("event",))
+
+
+class _StageTimer:
+    __slots__ = ("labels", "started")
+
+    def __init__(self, name: str):
+        self.labels = (name,)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def stage(name: str):
+    """with stage("model_encode"): ... records the block's duration."""
+    return _StageTimer(name) if METRICS_ENABLED else _NULL_TIMER
+
+
+def timed(name: str):
+    """Decorator form of stage() for whole functions."""
+    def decorate(fn):
+        if not METRICS_ENABLED:
+            return fn
+        labels = (name,)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - started, *labels)
+        return wrapper
+    return decorate
+
+
+def count(event: str):
+    if METRICS_ENABLED:
+        EVENTS.inc(event)
+
+
+# Per-request DB round trips. The middleware installs a one-element list;
+# threadpool work runs in a copy of the request context, which still points
+# at the same list.
+_round_trips = contextvars.ContextVar("db_round_trips", default=None)
+
+
+def _count_round_trip(kind: str):
+    DB_STATEMENTS.inc(kind)
+    trips = _round_trips.get()
+    if trips is not None:
+        trips[0] += 1
+
+
+def instrument_engine(engine):
+    if not METRICS_ENABLED:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _on_execute(conn, cursor, statement, parameters, context, executemany):
+        _count_round_trip("statement")
+
+    @event.listens_for(engine, "commit")
+    def _on_commit(conn):
+        _count_round_trip("commit")
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: request latency by route template, and DB round trips per request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        trips = [0]
+        token = _round_trips.set(trips)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"], path, str(status[0]))
+            DB_ROUND_TRIPS.observe(trips[0], path)
+            _round_trips.reset(token)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for name, help_text, fn in _gauges:
+        try:
+            value = fn()
+        except Exception:
+            continue
+        lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {_number(value)}"])
+    return "\n".join(lines) + "\n"
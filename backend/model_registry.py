@@ -0,0 +1,111 @@
+# model_registry.py
+import os
+import shutil
+import threading
+
+import numpy as np
+
+MODEL_NAME = os.environ.get("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+# "torch" (default), "onnx", or "onnx-int8" (dynamically quantized ONNX)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+VALID_BACKENDS = {"torch", "onnx", "onnx-int8"}
+
+ONNX_QUANTIZATION = os.environ.get("ONNX_QUANTIZATION", "avx2")  # arm64, avx2, avx512, avx512_vnni
+ONNX_MIN_COSINE = float(os.environ.get("ONNX_MIN_COSINE", "0.99"))
+CACHE_DIR = os.environ.get(
+    "MODEL_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+ONNX_DIR = os.environ.get("ONNX_MODEL_DIR", os.path.join(CACHE_DIR, "onnx"))
+
+AGREEMENT_TEXTS = [
+    "The team collaborates very well",
+    "Communication is clear but sometimes slow",
+    "Deadlines are often missed and processes feel chaotic",
+    "My manager supports me when things get difficult",
+]
+
+_models = {}
+_lock = threading.Lock()
+
+def get_model(name: str = MODEL_NAME, backend: str = EMBEDDING_BACKEND):
+    # One SentenceTransformer per (model, backend) per process, loaded on first use
+    key = (name, backend)
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                model = load_model(name, backend)
+                _models[key] = model
+    return model
+
+def load_model(name: str, backend: str):
+    if backend not in VALID_BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {sorted(VALID_BACKENDS)}")
+    from sentence_transformers import SentenceTransformer
+    if backend == "torch":
+        return SentenceTransformer(name)
+    return _load_onnx_model(name, quantized=backend == "onnx-int8")
+
+def _onnx_file_name(quantized: bool) -> str:
+    return f"onnx/model_int8_{ONNX_QUANTIZATION}.onnx" if quantized else "onnx/model.onnx"
+
+def _load_onnx_model(name: str, quantized: bool):
+    try:
+        from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    except ImportError as e:
+        raise RuntimeError(
+            "ONNX backends need optimum and onnxruntime: pip install 'optimum[onnxruntime]'"
+        ) from e
+
+    path = os.path.join(ONNX_DIR, name.replace("/", "--"))
+    file_name = _onnx_file_name(quantized)
+    graph = os.path.join(path, file_name)
+    # Written only once the graph has passed check_backend_agreement
+    marker = graph + ".verified"
+    model_kwargs = {"provider": "CPUExecutionProvider"}
+
+    # Export once; later starts load the saved graph directly
+    if not os.path.exists(os.path.join(path, "onnx", "model.onnx")):
+        SentenceTransformer(name, backend="onnx", device="cpu", model_kwargs=model_kwargs).save_pretrained(path)
+    if quantized and not os.path.exists(graph):
+        export_dynamic_quantized_onnx_model(
+            SentenceTransformer(path, backend="onnx", device="cpu", model_kwargs=model_kwargs),
+            quantization_config=ONNX_QUANTIZATION,
+            model_name_or_path=path,
+            file_suffix=f"int8_{ONNX_QUANTIZATION}",
+        )
+
+    verified = os.path.exists(marker)
+    try:
+        model = SentenceTransformer(
+            path, backend="onnx", device="cpu",
+            model_kwargs={**model_kwargs, "file_name": file_name},
+        )
+        if not verified:
+            check_backend_agreement(model, SentenceTransformer(name))
+    except Exception:
+        # A half-written or disagreeing export must not be served by the next start either
+        if not verified:
+            if quantized:
+                if os.path.exists(graph):
+                    os.remove(graph)
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+        raise
+    if not verified:
+        with open(marker, "w"):
+            pass
+    return model
+
+def check_backend_agreement(model, reference, texts=AGREEMENT_TEXTS, min_cosine: float = ONNX_MIN_COSINE) -> float:
+    # Row-wise cosine between a candidate backend and the PyTorch reference
+    a = np.asarray(model.encode(texts), dtype=np.float64)
+    b = np.asarray(reference.encode(texts), dtype=np.float64)
+    cosines = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    worst = float(cosines.min())
+    if worst < min_cosine:
+        raise RuntimeError(f"Encoder backend disagrees with PyTorch: min cosine {worst:.4f} < {min_cosine}")
+    return worst
@@ -0,0 +1,39 @@
+# Bulk-create employees/managers from a CSV or JSONL file.
+#
+#   python provision_users.py users.csv
+#   python provision_users.py users.jsonl --workers 8 --chunk-size 2000
+#
+# CSV needs an email,password,role,department header; JSONL has one object per line.
+import argparse
+import json
+import os
+import time
+
+from database import SessionLocal, init_db
+from auth.provisioning import PROVISION_CHUNK_SIZE, PROVISION_HASH_WORKERS, provision_users
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk user provisioning")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None, help="defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=PROVISION_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=PROVISION_HASH_WORKERS)
+    args = parser.parse_args()
+
+    fmt = args.format or ("jsonl" if os.path.splitext(args.path)[1].lower() in (".jsonl", ".ndjson") else "csv")
+
+    init_db()
+    db = SessionLocal()
+    start = time.perf_counter()
+    try:
+        with open(args.path, encoding="utf-8", newline="") as f:
+            report = provision_users(f, fmt, db, chunk_size=args.chunk_size, hash_workers=args.workers)
+    finally:
+        db.close()
+    report["seconds"] = round(time.perf_counter() - start, 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
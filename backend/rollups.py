@@ -0,0 +1,224 @@
+# rollups.py
+import sys
+import zlib
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from fl_aggregation import DepartmentFLState, _apply_row
+
+COMPANY = "company"
+# Fixed: a department's deltas must keep landing in the shard they were added to
+NUM_SHARDS = 16
+
+
+def division_scope(division: str) -> str:
+    return f"division:{division}"
+
+
+def department_shard(department: str) -> int:
+    return zlib.crc32(department.encode("utf-8")) % NUM_SHARDS
+
+
+def _empty_state(embedding_dim: int) -> DepartmentFLState:
+    # Rollups have no client limit
+    return DepartmentFLState(embedding_dim=embedding_dim, max_clients=sys.maxsize)
+
+
+def _ensure_rows(scopes, form_id: str, shard: int, db: Session):
+    from database import RollupState
+    rows = [{"scope": scope, "form_id": form_id, "shard": shard, "client_count": 0, "version": 0} for scope in scopes]
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        db.execute(postgresql.insert(RollupState).on_conflict_do_nothing(), rows)
+    elif dialect == "sqlite":
+        db.execute(sqlite.insert(RollupState).on_conflict_do_nothing(), rows)
+    else:
+        for row in rows:
+            if db.get(RollupState, (row["scope"], row["form_id"], row["shard"])) is None:
+                db.add(RollupState(**row))
+        db.flush()
+
+
+def _row_state(db_row, embedding_dim: int) -> DepartmentFLState:
+    state = _empty_state(embedding_dim)
+    state.client_count = db_row.client_count
+    state.version = db_row.version
+    if db_row.aggregated_embedding:
+        state.load_bytes(db_row.aggregated_embedding)
+    return state
+
+
+def _load_shard(scope: str, form_id: str, shard: int, embedding_dim: int, db: Session) -> DepartmentFLState:
+    # Locks the row for the rest of the transaction
+    from database import RollupState
+    db_row = db.query(RollupState).filter(
+        RollupState.scope == scope, RollupState.form_id == form_id, RollupState.shard == shard
+    ).with_for_update().populate_existing().first()
+    return _row_state(db_row, embedding_dim) if db_row is not None else _empty_state(embedding_dim)
+
+
+def _load(scope: str, form_id: str, embedding_dim: int, db: Session) -> DepartmentFLState:
+    """Sum of the scope's shards; version is the sum of shard versions, so it grows on every write."""
+    from database import RollupState
+    total = _empty_state(embedding_dim)
+    total.version = 0
+    rows = db.query(RollupState).filter(RollupState.scope == scope, RollupState.form_id == form_id)
+    for db_row in rows.populate_existing():
+        total.merge(_row_state(db_row, embedding_dim))
+        total.version += db_row.version
+    return total
+
+
+def _write(scope: str, form_id: str, shard: int, state: DepartmentFLState, db: Session):
+    from database import RollupState
+    db.execute(
+        update(RollupState)
+        .where(RollupState.scope == scope, RollupState.form_id == form_id, RollupState.shard == shard)
+        .values(
+            client_count=state.client_count,
+            aggregated_embedding=state.to_bytes() if state.client_count else None,
+            version=RollupState.version + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _lock_company(db: Session):
+    # A no-op UPDATE rather than FOR UPDATE so SQLite takes its write lock too
+    from database import RollupState
+    db.execute(
+        update(RollupState)
+        .where(RollupState.scope == COMPANY)
+        .values(version=RollupState.version)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def department_division(department: str, db: Session):
+    from database import DepartmentDivision
+    return db.execute(
+        select(DepartmentDivision.division).where(DepartmentDivision.department == department)
+    ).scalar()
+
+
+def apply_rollup_delta(department: str, form_id: str, delta: DepartmentFLState, db: Session, subtract: bool = False):
+    """
+    Folds a change to one department's aggregate into its shard of the
+    company rollup and of its division's rollup, in the caller's transaction
+    (no commit). Only departments sharing a shard contend for the same rows.
+    The company shard row is always locked first; division changes lock
+    every company row, so the division read here can't go stale before the
+    write.
+    """
+    if delta.client_count == 0:
+        return
+    shard = department_shard(department)
+    _ensure_rows([COMPANY], form_id, shard, db)
+    targets = [(COMPANY, _load_shard(COMPANY, form_id, shard, delta.embedding_dim, db))]
+    division = department_division(department, db)
+    if division is not None:
+        scope = division_scope(division)
+        _ensure_rows([scope], form_id, shard, db)
+        targets.append((scope, _load_shard(scope, form_id, shard, delta.embedding_dim, db)))
+    for scope, state in targets:
+        if subtract:
+            state.unmerge(delta)
+        else:
+            state.merge(delta)
+        _write(scope, form_id, shard, state, db)
+
+
+def load_rollup(form_id: str, embedding_dim: int, db: Session, division: str = None) -> DepartmentFLState:
+    scope = COMPANY if division is None else division_scope(division)
+    return _load(scope, form_id, embedding_dim, db)
+
+
+def _recompute(embedding_dim: int, db: Session, divisions=None) -> dict:
+    """
+    Rebuilds rollups by merging department aggregates (never submissions).
+    With divisions=None every scope is rebuilt, otherwise only those divisions.
+    Returns {(scope, form_id, shard): DepartmentFLState}.
+    """
+    from database import DepartmentDivision, DepartmentState
+    mapping = dict(db.execute(select(DepartmentDivision.department, DepartmentDivision.division)).all())
+    query = db.query(DepartmentState).filter(DepartmentState.client_count > 0)
+    if divisions is not None:
+        members = [dept for dept, division in mapping.items() if division in divisions]
+        query = query.filter(DepartmentState.department.in_(members))
+    rollups = {}
+    for db_row in query:
+        dept_state = _empty_state(embedding_dim)
+        _apply_row(dept_state, db_row)
+        scopes = [] if divisions is not None else [COMPANY]
+        if db_row.department in mapping:
+            scopes.append(division_scope(mapping[db_row.department]))
+        shard = department_shard(db_row.department)
+        for scope in scopes:
+            rollups.setdefault((scope, db_row.form_id, shard), _empty_state(embedding_dim)).merge(dept_state)
+    return rollups
+
+
+def _store(rollups: dict, scopes, embedding_dim: int, db: Session):
+    # Overwrites the given scopes with recomputed aggregates; rows with nothing left are zeroed
+    from database import RollupState
+    existing = db.execute(
+        select(RollupState.scope, RollupState.form_id, RollupState.shard).where(RollupState.scope.in_(list(scopes)))
+    ).all()
+    for scope, form_id, shard in existing:
+        rollups.setdefault((scope, form_id, shard), _empty_state(embedding_dim))
+    for (scope, form_id, shard), state in rollups.items():
+        _ensure_rows([scope], form_id, shard, db)
+        _write(scope, form_id, shard, state, db)
+
+
+def rebuild_rollups(embedding_dim: int, db: Session):
+    """Recomputes every rollup from department states and commits."""
+    from database import DepartmentDivision
+    _lock_company(db)
+    divisions = db.execute(select(DepartmentDivision.division).distinct()).scalars().all()
+    _store(_recompute(embedding_dim, db), [COMPANY] + [division_scope(d) for d in divisions], embedding_dim, db)
+    db.commit()
+
+
+def ensure_rollups(embedding_dim: int, db: Session):
+    # Databases from before rollups existed get them built once from department states
+    from database import DepartmentState, RollupState
+    if db.query(RollupState.scope).first() is None and db.query(DepartmentState.id).filter(
+        DepartmentState.client_count > 0
+    ).first() is not None:
+        rebuild_rollups(embedding_dim, db)
+
+
+def set_department_division(department: str, division, embedding_dim: int, db: Session):
+    """
+    Moves a department into division (None removes it from any division) and
+    rebuilds the old and new division rollups. The company rollup is unchanged.
+    """
+    from database import DepartmentDivision
+    _lock_company(db)
+    previous = department_division(department, db)
+    if previous == division:
+        db.commit()
+        return
+    db.execute(delete(DepartmentDivision).where(DepartmentDivision.department == department))
+    if division is not None:
+        db.add(DepartmentDivision(department=department, division=division))
+    db.flush()
+    affected = [d for d in (previous, division) if d is not None]
+    _store(_recompute(embedding_dim, db, divisions=affected), [division_scope(d) for d in affected], embedding_dim, db)
+    db.commit()
+
+
+def list_divisions(db: Session) -> dict:
+    """Returns {division: [departments]}."""
+    from database import DepartmentDivision
+    divisions = {}
+    rows = db.execute(
+        select(DepartmentDivision.division, DepartmentDivision.department)
+        .order_by(DepartmentDivision.division, DepartmentDivision.department)
+    )
+    for division, department in rows:
+        divisions.setdefault(division, []).append(department)
+    return divisions
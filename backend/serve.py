@@ -0,0 +1,192 @@
+# serve.py
+#
+#   python serve.py            (HOST, PORT, WEB_CONCURRENCY workers)
+#
+# Preload-and-fork server for api.app. The master process imports the app,
+# loads the sentence-transformer and anchor matrix, runs init_db once, then
+# freezes the heap and forks the workers, which share the weight pages
+# copy-on-write instead of each loading a copy. The master restarts workers
+# that die; `kill -USR1 <master>` logs a memory report (RSS/PSS/private per
+# process). Linux/macOS only (needs os.fork).
+import gc
+import json
+import os
+import signal
+import socket
+import sys
+import time
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8000"))
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", "2"))
+WEB_TORCH_THREADS = int(os.environ.get("WEB_TORCH_THREADS", "1"))
+GRACEFUL_TIMEOUT_S = float(os.environ.get("GRACEFUL_TIMEOUT_S", "30"))
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "info")
+
+
+def _log(message: str):
+    print(f"[serve {os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+
+def memory_usage(pid: int) -> dict:
+    """MB figures from /proc/<pid>/smaps_rollup; private is what the process alone costs."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    mb = lambda kb: round(kb / 1024, 1)
+    return {
+        "pid": pid,
+        "rss_mb": mb(fields.get("Rss", 0)),
+        "pss_mb": mb(fields.get("Pss", 0)),
+        "shared_mb": mb(fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)),
+        "private_mb": mb(fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)),
+    }
+
+
+def memory_report(master_pid: int, worker_pids) -> dict:
+    master = memory_usage(master_pid)
+    workers = [memory_usage(pid) for pid in worker_pids]
+    processes = [master] + workers
+    return {
+        "master": master,
+        "workers": workers,
+        "total_rss_mb": round(sum(p["rss_mb"] for p in processes), 1),
+        # PSS splits each shared page between its sharers, so this is the real footprint
+        "total_pss_mb": round(sum(p["pss_mb"] for p in processes), 1),
+    }
+
+
+def _freeze_model(model):
+    # Inference only: no grad buffers, and the weights are never written after fork
+    model.eval()
+    for param in model.parameters():
+        param.requires_grad_(False)
+
+
+def preload():
+    """Everything the workers should inherit instead of building per process."""
+    # Tokenizer and intra-op thread pools do not survive fork; keep the master single-threaded
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    import torch
+    torch.set_num_threads(WEB_TORCH_THREADS)
+
+    import api
+    from anchor_embeddings import ANCHOR_MATRIX
+    from database import engine
+    from encoder_pool import ENCODER_PROCESSES
+    from model_registry import EMBEDDING_BACKEND, get_model
+
+    # Migrations and backfills once; the forked workers' lifespans then skip them
+    api.prepare_database()
+    # No pooled connection may be shared across fork
+    engine.dispose()
+
+    # With ENCODER_PROCESSES the model lives in the encoder pool instead; the
+    # ONNX runtime's session threads would not survive fork either
+    if ENCODER_PROCESSES == 0 and EMBEDDING_BACKEND == "torch":
+        _freeze_model(get_model())
+    ANCHOR_MATRIX.setflags(write=False)
+    return api.app
+
+
+def _run_worker(app, sock: socket.socket):
+    import numpy as np
+    import uvicorn
+
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    gc.enable()
+    # Forked workers would otherwise draw identical DP noise
+    np.random.seed()
+    config = uvicorn.Config(app, lifespan="on", log_level=LOG_LEVEL)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve(app, workers: int = WEB_CONCURRENCY, host: str = HOST, port: int = PORT):
+    sock = _bind(host, port)
+    children = set()
+    flags = {"stopping": False, "report": False}
+
+    def fork_worker():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(app, sock)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children.add(pid)
+        return pid
+
+    def on_stop(signum, frame):
+        flags["stopping"] = True
+
+    def on_report(signum, frame):
+        flags["report"] = True
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGUSR1, on_report)
+
+    # Objects created so far are never collected, so the GC never writes to their pages
+    gc.collect()
+    gc.freeze()
+    for _ in range(max(workers, 1)):
+        fork_worker()
+    _log(f"listening on {host}:{port} with {len(children)} workers: {sorted(children)}")
+
+    while not flags["stopping"]:
+        time.sleep(0.5)
+        if flags["report"]:
+            flags["report"] = False
+            _log("memory " + json.dumps(memory_report(os.getpid(), sorted(children))))
+        for pid in list(children):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done and not flags["stopping"]:
+                children.discard(pid)
+                _log(f"worker {pid} exited ({status}), restarting")
+                time.sleep(1)
+                fork_worker()
+
+    _log("shutting down")
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + GRACEFUL_TIMEOUT_S
+    while children and time.monotonic() < deadline:
+        for pid in list(children):
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                children.discard(pid)
+        time.sleep(0.1)
+    for pid in children:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    sock.close()
+
+
+if __name__ == "__main__":
+    # Nothing allocated during preload should be scanned (and dirtied) by the GC
+    gc.disable()
+    serve(preload())
@@ -1,10 +1,38 @@
-from fastapi import FastAPI
+import threading
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from fl_client import local_train
-import torch
+from fl_rounds import SharedRound
+
+# Round state is shared by every worker process through a file-backed running sum
+fl_round = SharedRound()
+ROUND_POLL_S = 1.0
+
+
+def _log_global_model(global_model, clients: int):
+    print(f"Federated aggregation completed | Clients: {clients}")
+    print("Global model vector:", global_model.tolist())
+
 
-app = FastAPI()
+def _expire_rounds(stop: threading.Event):
+    while not stop.wait(ROUND_POLL_S):
+        global_model = fl_round.close_if_expired()
+        if global_model is not None:
+            _log_global_model(global_model, fl_round.status()["last_round_clients"])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stop = threading.Event()
+    threading.Thread(target=_expire_rounds, args=(stop,), daemon=True, name="fl-round-timeout").start()
+    yield
+    stop.set()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # ------------------- CORS setup -------------------
 origins = [
@@ -21,26 +49,24 @@ app.add_middleware(
 )
 # ---------------------------------------------------
 
-client_updates = []
-
 class Feedback(BaseModel):
     feedback: str
 
 @app.post("/submit-feedback")
 def submit_feedback(data: Feedback):
     update, loss = local_train(data.feedback)
-    client_updates.append(update)
 
     print(f"Client update received | Loss: {loss:.4f}")
 
-    # Simulate federated aggregation
-    if len(client_updates) >= 2:
-        global_model = federated_average(client_updates)
-        client_updates.clear()
-        print("Federated aggregation completed")
-        print("Global model vector:", global_model.tolist())
+    try:
+        clients, global_model = fl_round.add(update.detach().cpu().numpy())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if global_model is not None:
+        _log_global_model(global_model, clients)
 
     return {"status": "received"}
 
-def federated_average(updates):
-    return torch.stack(updates).mean(dim=0)
+@app.get("/round-status")
+def round_status():
+    return fl_round.status()
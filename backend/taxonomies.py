@@ -0,0 +1,225 @@
+# taxonomies.py
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from anchor_embeddings import ANCHOR_KEYS, ANCHOR_MATRIX, normalize_rows
+from metrics import timed
+from model_registry import MODEL_NAME, get_model
+
+DEFAULT_SCOPE = "default"
+TAXONOMY_CACHE_TTL_S = float(os.environ.get("TAXONOMY_CACHE_TTL_S", "30"))
+ANCHOR_EMBED_BATCH_SIZE = int(os.environ.get("ANCHOR_EMBED_BATCH_SIZE", "64"))
+MAX_ANCHORS_PER_SET = int(os.environ.get("MAX_ANCHORS_PER_SET", "5000"))
+
+
+class TaxonomyConflictError(Exception):
+    """Another writer saved a new version of the same scope first."""
+
+
+class Taxonomy:
+    """One anchor set version: keys and their unit-length float32 rows, read-only."""
+
+    __slots__ = ("scope", "version", "keys", "matrix")
+
+    def __init__(self, scope: str, version: int, keys, matrix):
+        self.scope = scope
+        self.version = version
+        self.keys = list(keys)
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.matrix.setflags(write=False)
+
+
+# The six INSIGHT_ANCHORS, used wherever no stored taxonomy applies
+BUILTIN_TAXONOMY = Taxonomy(DEFAULT_SCOPE, 0, ANCHOR_KEYS, ANCHOR_MATRIX)
+
+
+def taxonomy_scope(department: str = None, form_id: str = None) -> str:
+    parts = []
+    if department is not None:
+        parts.append(f"department:{department}")
+    if form_id is not None:
+        parts.append(f"form:{form_id}")
+    return "|".join(parts) or DEFAULT_SCOPE
+
+
+def _candidate_scopes(department: str, form_id: str) -> list:
+    # Most specific first
+    scopes = []
+    if department is not None and form_id is not None:
+        scopes.append(taxonomy_scope(department, form_id))
+    if department is not None:
+        scopes.append(taxonomy_scope(department))
+    if form_id is not None:
+        scopes.append(taxonomy_scope(form_id=form_id))
+    scopes.append(DEFAULT_SCOPE)
+    return scopes
+
+
+_cache = {"expires_at": 0.0, "active": None}  # active: {scope: latest version}
+_taxonomies = {}  # (scope, version) -> Taxonomy
+_lock = threading.Lock()
+
+
+def _latest_sets(db: Session):
+    from database import AnchorSet
+    latest = (
+        select(AnchorSet.scope, func.max(AnchorSet.version).label("version"))
+        .group_by(AnchorSet.scope)
+        .subquery()
+    )
+    return db.execute(
+        select(AnchorSet)
+        .join(latest, (AnchorSet.scope == latest.c.scope) & (AnchorSet.version == latest.c.version))
+        .order_by(AnchorSet.scope)
+    ).scalars().all()
+
+
+def _active_versions(db: Session) -> dict:
+    """{scope: version} of every live taxonomy, cached for TAXONOMY_CACHE_TTL_S."""
+    with _lock:
+        if _cache["active"] is not None and _cache["expires_at"] > time.monotonic():
+            return _cache["active"]
+    active = {row.scope: row.version for row in _latest_sets(db) if row.anchor_count}
+    with _lock:
+        _cache["active"] = active
+        _cache["expires_at"] = time.monotonic() + TAXONOMY_CACHE_TTL_S
+        for key in [key for key in _taxonomies if active.get(key[0]) != key[1]]:
+            del _taxonomies[key]
+    return active
+
+
+def invalidate_taxonomy_cache():
+    with _lock:
+        _cache["active"] = None
+
+
+@timed("anchor_embed")
+def embed_anchor_texts(texts) -> np.ndarray:
+    """(len(texts), dim) unit-length float32 rows, encoded ANCHOR_EMBED_BATCH_SIZE at a time."""
+    vectors = get_model().encode(list(texts), batch_size=ANCHOR_EMBED_BATCH_SIZE)
+    return normalize_rows(vectors)
+
+
+def _load(scope: str, version: int, db: Session) -> Taxonomy:
+    from database import Anchor, AnchorSet
+    model_name = db.execute(
+        select(AnchorSet.model_name).where(AnchorSet.scope == scope, AnchorSet.version == version)
+    ).scalar_one()
+    rows = db.execute(
+        select(Anchor.key, Anchor.text, Anchor.embedding)
+        .where(Anchor.scope == scope, Anchor.version == version)
+        .order_by(Anchor.position)
+    ).all()
+    if model_name == MODEL_NAME:
+        matrix = np.frombuffer(b"".join(row.embedding for row in rows), dtype="<f4").reshape(len(rows), -1)
+    else:
+        # Stored under a different encoder: their vectors are not comparable to ours
+        matrix = embed_anchor_texts([row.text for row in rows])
+    return Taxonomy(scope, version, [row.key for row in rows], matrix)
+
+
+def resolve_taxonomy(department: str, form_id: str, db: Session) -> Taxonomy:
+    """
+    The taxonomy for a department/form: the first live one among
+    department+form, department, form and default, else the built-in anchors.
+    Pass department=None for company or division insights.
+    """
+    active = _active_versions(db)
+    for scope in _candidate_scopes(department, form_id):
+        version = active.get(scope)
+        if version is None:
+            continue
+        key = (scope, version)
+        with _lock:
+            taxonomy = _taxonomies.get(key)
+        if taxonomy is None:
+            taxonomy = _load(scope, version, db)
+            with _lock:
+                _taxonomies[key] = taxonomy
+        return taxonomy
+    return BUILTIN_TAXONOMY
+
+
+def _next_version(scope: str, db: Session) -> int:
+    from database import AnchorSet
+    return (db.execute(select(func.max(AnchorSet.version)).where(AnchorSet.scope == scope)).scalar() or 0) + 1
+
+
+def save_taxonomy(anchors: dict, db: Session, department: str = None, form_id: str = None) -> dict:
+    """
+    Stores {key: phrase} as the next version of the scope's taxonomy.
+    Phrases unchanged since the previous version keep their embeddings; only
+    new ones are encoded, in batches.
+    """
+    from database import Anchor, AnchorSet
+    anchors = {key.strip(): text.strip() for key, text in anchors.items()}
+    if not anchors:
+        raise ValueError("A taxonomy needs at least one anchor")
+    if len(anchors) > MAX_ANCHORS_PER_SET:
+        raise ValueError(f"A taxonomy holds at most {MAX_ANCHORS_PER_SET} anchors")
+    if not all(anchors) or not all(anchors.values()):
+        raise ValueError("Anchor keys and phrases must not be empty")
+
+    scope = taxonomy_scope(department, form_id)
+    version = _next_version(scope, db)
+    known = dict(db.execute(
+        select(Anchor.text, Anchor.embedding)
+        .join(AnchorSet, (Anchor.scope == AnchorSet.scope) & (Anchor.version == AnchorSet.version))
+        .where(Anchor.scope == scope, Anchor.version == version - 1, AnchorSet.model_name == MODEL_NAME)
+    ).all())
+    missing = [text for text in dict.fromkeys(anchors.values()) if text not in known]
+    if missing:
+        for text, vector in zip(missing, embed_anchor_texts(missing)):
+            known[text] = vector.astype("<f4").tobytes()
+
+    db.add(AnchorSet(scope=scope, version=version, model_name=MODEL_NAME, anchor_count=len(anchors)))
+    db.execute(insert(Anchor), [
+        {"scope": scope, "version": version, "position": i, "key": key, "text": text, "embedding": known[text]}
+        for i, (key, text) in enumerate(anchors.items())
+    ])
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise TaxonomyConflictError(f"Taxonomy {scope} was changed concurrently, retry")
+    invalidate_taxonomy_cache()
+    return {"scope": scope, "version": version, "anchor_count": len(anchors), "embedded": len(missing)}
+
+
+def remove_taxonomy(db: Session, department: str = None, form_id: str = None) -> dict:
+    """Records an empty version so the scope falls back to the next one; history is kept."""
+    from database import AnchorSet
+    scope = taxonomy_scope(department, form_id)
+    if scope not in _active_versions(db):
+        invalidate_taxonomy_cache()
+        if scope not in _active_versions(db):
+            raise ValueError(f"No taxonomy for {scope}")
+    version = _next_version(scope, db)
+    db.add(AnchorSet(scope=scope, version=version, model_name=MODEL_NAME, anchor_count=0))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise TaxonomyConflictError(f"Taxonomy {scope} was changed concurrently, retry")
+    invalidate_taxonomy_cache()
+    return {"scope": scope, "version": version}
+
+
+def list_taxonomies(db: Session) -> list:
+    return [
+        {
+            "scope": row.scope,
+            "version": row.version,
+            "anchor_count": row.anchor_count,
+            "model_name": row.model_name,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+        }
+        for row in _latest_sets(db)
+        if row.anchor_count
+    ]
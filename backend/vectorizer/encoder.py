@@ -1,14 +1,16 @@
-from sentence_transformers import SentenceTransformer
+from model_registry import EMBEDDING_BACKEND, MODEL_NAME, get_model
 
 class FeedbackEncoder:
-    def __init__(self):
-        self.model = SentenceTransformer(
-            "sentence-transformers/all-MiniLM-L6-v2"
-        )
+    def __init__(self, backend: str = EMBEDDING_BACKEND):
+        """
+        backend: "torch", "onnx" or "onnx-int8"
+        """
+        # Same registry key as the API's encoder, so one process holds one copy
+        self.model = get_model(MODEL_NAME, backend)
 
-    def encode(self, texts):
+    def encode(self, texts, batch_size: int = 32):
         """
         texts: str or List[str]
         returns: numpy array
         """
-        return self.model.encode(texts)
+        return self.model.encode(texts, batch_size=batch_size)
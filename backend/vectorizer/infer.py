@@ -1,3 +1,6 @@
+import os
+
+import numpy as np
 import torch
 from encoder import FeedbackEncoder
 from head import FeedbackVectorHead
@@ -11,25 +14,54 @@ LABELS = [
     "performance"
 ]
 
+VECTORIZE_BATCH_SIZE = int(os.environ.get("VECTORIZE_BATCH_SIZE", "64"))
+
 class FeedbackVectorizer:
     def __init__(self):
         self.encoder = FeedbackEncoder()
         self.head = FeedbackVectorHead()
 
     def vectorize(self, responses: dict):
-        texts = list(responses.values())
+        _, views = self.vectorize_many([responses])
+        return views[0]
 
-        embeddings = self.encoder.encode(texts)
+    def _encode_bucketed(self, texts, batch_size: int) -> np.ndarray:
+        # Similar lengths share a batch so little padding is encoded; rows come back in input order
+        order = np.argsort(np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts)), kind="stable")
+        sorted_texts = [texts[i] for i in order]
+        encoded = np.concatenate([
+            np.asarray(self.encoder.encode(sorted_texts[start:start + batch_size], batch_size=batch_size),
+                       dtype=np.float32)
+            for start in range(0, len(sorted_texts), batch_size)
+        ])
+        embeddings = np.empty_like(encoded)
+        embeddings[order] = encoded
+        return embeddings
 
-        if len(embeddings.shape) == 2:
-            embedding = embeddings.mean(axis=0)
-        else:
-            embedding = embeddings
+    def vectorize_many(self, responses_list, batch_size: int = VECTORIZE_BATCH_SIZE):
+        """
+        responses_list: list of response dicts, one per respondent
+        returns: (scores, views) where scores is a float32 (N, 6) array in
+        LABELS order and views the matching list of {label: score} dicts.
+        A respondent with no answers is scored from a zero embedding.
+        """
+        n = len(responses_list)
+        dim = self.head.linear.in_features
+        texts = [text for responses in responses_list for text in responses.values()]
+        lengths = np.fromiter((len(responses) for responses in responses_list), dtype=np.int64, count=n)
 
-        embedding_tensor = torch.tensor(embedding).float()
+        means = np.zeros((n, dim), dtype=np.float32)
+        if texts:
+            embeddings = self._encode_bucketed(texts, batch_size)
+            # Segment mean: offsets mark where each respondent's rows start.
+            # Empty respondents are dropped from reduceat and stay zero.
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            answered = lengths > 0
+            sums = np.add.reduceat(embeddings, offsets[answered], axis=0)
+            means[answered] = sums / lengths[answered, None]
 
-        with torch.no_grad():
-            output = self.head(embedding_tensor)
+        with torch.inference_mode():
+            scores = self.head(torch.from_numpy(means)).numpy()
 
-        values = output.numpy().tolist()
-        return dict(zip(LABELS, values))
+        views = [dict(zip(LABELS, row)) for row in scores.tolist()]
+        return scores, views
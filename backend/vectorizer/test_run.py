@@ -1,3 +1,5 @@
+# Run from backend/vectorizer with backend/ importable:
+#   PYTHONPATH=.. python test_run.py
 from infer import FeedbackVectorizer
 
 if __name__ == "__main__":
@@ -11,3 +13,6 @@ if __name__ == "__main__":
     vectors = vectorizer.vectorize(feedback)
 
     print(vectors)
+
+    scores, views = vectorizer.vectorize_many([feedback, {"Support": "Managers are supportive"}, {}])
+    print(scores.shape, views[1])